@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useRef } from 'react';
 import ImageDisplay from './components/ImageDisplay';
 import MethodSelector from './components/MethodSelector';
 import ProcessingOptions from './components/ProcessingOptions';
@@ -39,6 +39,12 @@ function FileUploader() {
   const [processedFileSizeKB, setProcessedFileSizeKB] = useState(0);
   const [processingType, setProcessingType] = useState(null);
   const [currentImageUrl, setCurrentImageUrl] = useState(null);
+  const [resizeHandle, setResizeHandle] = useState(null); // handle ของภาพที่ resize แล้ว (ใช้กับ sharpen)
+  const [sourceHandle, setSourceHandle] = useState(null); // handle ของภาพล่าสุดจาก resize/sharpen (ใช้กับ enhance)
+  const [previewUrl, setPreviewUrl] = useState(null); // ภาพ preview ระหว่างเลื่อน slider (object URL)
+  const previewAbortRef = useRef(null);
+  const previewInFlightRef = useRef(false); // มี preview ที่รอผลจาก server อยู่หรือไม่
+  const previewPendingRef = useRef(null); // ค่าล่าสุดของ slider ที่รอส่งหลัง preview ปัจจุบันเสร็จ
   const [alertMessage, setAlertMessage] = useState('');
   const [showOptions, setShowOptions] = useState(false);
   const [showDownloadPopup, setShowDownloadPopup] = useState(false);
@@ -64,6 +70,8 @@ function FileUploader() {
     setOriginalFile(selectedFile);
     setResizedFile(null);
     setProcessedFile(null);
+    setResizeHandle(null);
+    setSourceHandle(null);
     setShowOriginal(true);
     setDownloadFormat("original");
     setSharpness(SHARPNESS_CONFIG.defaultValue); // รีเซ็ต sharpness เป็น 0
@@ -148,6 +156,8 @@ function FileUploader() {
       const data = await response.json();
       const newImageUrl = `http://localhost:8000${data.url}?t=${Date.now()}`;
       setCurrentImageUrl(newImageUrl);
+      setResizeHandle(data.handle);
+      setSourceHandle(data.handle);
 
       // ดึงไฟล์ที่ resize แล้ว
       const imageResp = await fetch(newImageUrl);
@@ -188,6 +198,7 @@ const handleSharpen = async (sharpnessValue = sharpness) => {
 
   try {
     const formData = new FormData();
+    formData.append("handle", resizeHandle);
     formData.append("sharpness", sharpnessValue.toString()); // ใช้ sharpnessValue แทน sharpness
 
     const response = await fetch(`http://localhost:8000/api/resize/${method}/sharpen`, {
@@ -202,6 +213,8 @@ const handleSharpen = async (sharpnessValue = sharpness) => {
     const data = await response.json();
     const sharpenedUrl = `http://localhost:8000${data.url}?t=${Date.now()}`;
     setCurrentImageUrl(sharpenedUrl);
+    clearPreview();
+    setSourceHandle(data.handle);
 
     // ดึงไฟล์ที่ sharpen แล้ว
     const imageResp = await fetch(sharpenedUrl);
@@ -237,6 +250,7 @@ const enhanceImage = async (noiseReductionValue = 0.0, autoDetect = true) => {
 
   try {
     const formData = new FormData();
+    formData.append("handle", sourceHandle);
     formData.append("noise_reduction", noiseReductionValue.toString());
 
     const response = await fetch(`http://localhost:8000/api/resize/${method}/enhance_image`, {
@@ -254,6 +268,7 @@ const enhanceImage = async (noiseReductionValue = 0.0, autoDetect = true) => {
     const data = await response.json();
     const enhancedUrl = `http://localhost:8000${data.url}?t=${Date.now()}`;
     setCurrentImageUrl(enhancedUrl);
+    clearPreview();
 
     // โหลดไฟล์ใหม่ที่ถูก enhance
     const imageResp = await fetch(enhancedUrl);
@@ -282,6 +297,72 @@ const enhanceImage = async (noiseReductionValue = 0.0, autoDetect = true) => {
 };
 
 
+// preview ระหว่างเลื่อน slider: server ประมวลผลบนภาพย่อขนาดจอแล้วส่งภาพกลับเลย (ไม่เปลี่ยน handle / ไฟล์)
+// ส่งทีละคำขอ: ระหว่างรอผล เก็บเฉพาะค่าล่าสุดไว้ แล้วส่งต่อเมื่อคำขอก่อนหน้าเสร็จ
+// (abort ฝั่ง browser ไม่ได้หยุดงานที่ server การส่งทุก onChange จะทำให้คิวของ server ยาวขึ้นเรื่อยๆ)
+const requestPreview = (endpoint, fields) => {
+  if (!resizedFile) return;
+
+  previewPendingRef.current = { url: `http://localhost:8000/api/resize/${method}/${endpoint}`, fields };
+  if (!previewInFlightRef.current) {
+    sendPreview();
+  }
+};
+
+const sendPreview = async () => {
+  const next = previewPendingRef.current;
+  previewPendingRef.current = null;
+  if (!next) return;
+
+  const controller = new AbortController();
+  previewAbortRef.current = controller;
+  previewInFlightRef.current = true;
+
+  try {
+    const formData = new FormData();
+    Object.entries(next.fields).forEach(([key, value]) => formData.append(key, value.toString()));
+    formData.append("preview", "true");
+
+    const response = await fetch(next.url, {
+      method: 'POST',
+      body: formData,
+      signal: controller.signal
+    });
+    if (!response.ok) return;
+
+    const blob = await response.blob();
+    if (controller.signal.aborted) return;
+    setPreviewUrl((prev) => {
+      if (prev) URL.revokeObjectURL(prev);
+      return URL.createObjectURL(blob);
+    });
+  } catch (err) {
+    if (err.name !== 'AbortError') {
+      console.error('Preview error:', err);
+    }
+  } finally {
+    previewInFlightRef.current = false;
+    // ส่งค่าล่าสุดที่เลื่อนมาระหว่างรอ (ถ้ายังไม่ถูกยกเลิกด้วย clearPreview)
+    if (!controller.signal.aborted) {
+      sendPreview();
+    }
+  }
+};
+
+const previewSharpen = (sharpnessValue) => requestPreview('sharpen', { handle: resizeHandle, sharpness: sharpnessValue });
+
+const previewEnhance = (noiseReductionValue) => requestPreview('enhance_image', { handle: sourceHandle, noise_reduction: noiseReductionValue });
+
+// กลับไปแสดงภาพล่าสุดที่ประมวลผลเต็มความละเอียด (ปิด popup หรือได้ผลจริงแล้ว)
+const clearPreview = () => {
+  previewPendingRef.current = null;
+  previewAbortRef.current?.abort();
+  setPreviewUrl((prev) => {
+    if (prev) URL.revokeObjectURL(prev);
+    return null;
+  });
+};
+
   const toggleShowOriginal = () => {
     setShowOriginal(!showOriginal);
     if (showOriginal) {
@@ -377,7 +458,7 @@ const handleDownload = async () => {
       processedFileSizeKB={processedFileSizeKB}
       handleFileChange={handleFileChange}
       processingType={processingType}
-      currentImageUrl={currentImageUrl} // ส่ง currentImageUrl ไป
+      currentImageUrl={previewUrl || currentImageUrl} // ส่ง currentImageUrl ไป (preview ระหว่างเลื่อน slider ถ้ามี)
     />
 
       <button
@@ -416,6 +497,9 @@ const handleDownload = async () => {
           setSharpness={setSharpness}
           handleSharpen={handleSharpen}
           enhanceImage={enhanceImage}
+          previewSharpen={previewSharpen}
+          previewEnhance={previewEnhance}
+          clearPreview={clearPreview}
           noiseReduction={noiseReduction}
           setNoiseReduction={setNoiseReduction}
         />
@@ -501,6 +585,7 @@ const handleDownload = async () => {
                   <option value="image/jpeg">JPEG (.jpg)</option>
                   <option value="image/png">PNG (.png)</option>
                   <option value="image/webp">WEBP (.webp)</option>
+                  <option value="image/avif">AVIF (.avif)</option>
                 </select>
 
                 <button
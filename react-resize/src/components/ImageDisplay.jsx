@@ -188,7 +188,7 @@ const ImageDisplay = ({
         <input
           id="image-upload"
           type="file"
-          accept="image/jpeg,image/png,image/webp"
+          accept="image/jpeg,image/png,image/webp,image/heic,image/heif,image/avif,.heic,.heif,.avif"
           onChange={handleFileChange}
           className="hidden"
         />
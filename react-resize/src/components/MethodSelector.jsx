@@ -17,6 +17,9 @@ const MethodSelector = ({ method, setMethod, originalFile }) => {
         <option value="nearest">ความละเอียดต่ำ</option>
         <option value="bilinear">ความละเอียดปานกลาง</option>
         <option value="bicubic">ความละเอียดสูง</option>
+        <option value="lanczos">ความละเอียดสูงสุด (Lanczos)</option>
+        <option value="hamming">คมชัดสำหรับย่อภาพ (Hamming)</option>
+        <option value="box">ย่อภาพเร็ว (Box)</option>
       </select>
     </div>
   );
@@ -19,6 +19,9 @@ const ProcessingOptions = ({
   setSharpness,
   handleSharpen,
   enhanceImage,
+  previewSharpen,
+  previewEnhance,
+  clearPreview,
   originalFile,
   isProcessing,
   noiseReduction,
@@ -115,13 +118,19 @@ const ProcessingOptions = ({
       {/* Sharpness Popup */}
       {isPopupOpen && (
         <div className="fixed inset-0 bg-black bg-opacity-50 flex items-center justify-center z-50 p-4"
-          onClick={() => setIsPopupOpen(false)}
+          onClick={() => {
+            setIsPopupOpen(false);
+            clearPreview();
+          }}
         >
           <div className="relative bg-[#24262B] p-6 rounded-lg max-w-md w-full border border-[#36383D]"
             onClick={(e) => e.stopPropagation()}
           >
             <button
-              onClick={() => setIsPopupOpen(false)}
+              onClick={() => {
+                setIsPopupOpen(false);
+                clearPreview();
+              }}
               className="absolute top-3 right-3 text-gray-400 hover:text-white text-lg"
               title="ปิด"
             >
@@ -147,7 +156,11 @@ const ProcessingOptions = ({
                 max={SHARPNESS_CONFIG.max}
                 step={SHARPNESS_CONFIG.step}
                 value={sharpness}
-                onChange={(e) => setSharpness(parseFloat(e.target.value))}
+                onChange={(e) => {
+                  const value = parseFloat(e.target.value);
+                  setSharpness(value);
+                  previewSharpen(value); // preview บนภาพย่อ ได้ภาพจริงตอนกดตกลง
+                }}
                 disabled={isProcessing}
                 className="w-full h-1.5 bg-[#69707d] rounded-lg appearance-none cursor-pointer
                   [&::-webkit-slider-thumb]:appearance-none
@@ -197,14 +210,20 @@ const ProcessingOptions = ({
       {isEnhancePopupOpen && (
         <div
           className="fixed inset-0 bg-black bg-opacity-50 flex items-center justify-center z-50 p-4"
-          onClick={() => setIsEnhancePopupOpen(false)}
+          onClick={() => {
+            setIsEnhancePopupOpen(false);
+            clearPreview();
+          }}
         >
           <div
             className="relative bg-[#24262B] p-6 rounded-lg max-w-md w-full border border-[#36383D]"
             onClick={(e) => e.stopPropagation()}
           >
             <button
-              onClick={() => setIsEnhancePopupOpen(false)}
+              onClick={() => {
+                setIsEnhancePopupOpen(false);
+                clearPreview();
+              }}
               className="absolute top-3 right-3 text-gray-400 hover:text-white text-lg"
               title="ปิด"
             >
@@ -231,7 +250,11 @@ const ProcessingOptions = ({
                 max={NOISE_REDUCTION_CONFIG.max}
                 step={NOISE_REDUCTION_CONFIG.step}
                 value={noiseReduction}
-                onChange={(e) => setNoiseReduction(parseFloat(e.target.value))}
+                onChange={(e) => {
+                  const value = parseFloat(e.target.value);
+                  setNoiseReduction(value);
+                  previewEnhance(value); // preview บนภาพย่อ ได้ภาพจริงตอนกดตกลง
+                }}
                 disabled={isProcessing}
                 className="w-full h-1.5 bg-[#69707d] rounded-lg appearance-none cursor-pointer
                   [&::-webkit-slider-thumb]:appearance-none
@@ -7,7 +7,7 @@ const SHARPNESS_CONFIG = {
   defaultValue: 0
 };
 
-const SharpenControl = ({ sharpness, setSharpness, processingOptions, originalFile, toggleProcessingOption}) => {
+const SharpenControl = ({ sharpness, setSharpness, processingOptions, originalFile, toggleProcessingOption, previewSharpen, clearPreview}) => {
   const [isPopupOpen, setIsPopupOpen] = useState(false);
   
   if (!processingOptions.sharpen) return null;
@@ -57,7 +57,11 @@ const SharpenControl = ({ sharpness, setSharpness, processingOptions, originalFi
                 max={SHARPNESS_CONFIG.max}
                 step={SHARPNESS_CONFIG.step}
                 value={sharpness}
-                onChange={(e) => setSharpness(parseFloat(e.target.value))}
+                onChange={(e) => {
+                  const value = parseFloat(e.target.value);
+                  setSharpness(value);
+                  previewSharpen?.(value); // preview บนภาพย่อ ได้ภาพจริงตอน commit
+                }}
                 className="
                   w-full h-1.5 bg-[#69707d] rounded-lg appearance-none cursor-pointer
                   [&::-webkit-slider-thumb]:appearance-none
@@ -79,6 +83,7 @@ const SharpenControl = ({ sharpness, setSharpness, processingOptions, originalFi
                 onClick={() => {
                   setSharpness(SHARPNESS_CONFIG.defaultValue);
                   setIsPopupOpen(false);
+                  clearPreview?.();
                 }}
                 className="px-4 py-2 text-sm text-gray-300 hover:text-white"
               >
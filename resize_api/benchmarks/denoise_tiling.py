@@ -0,0 +1,82 @@
+"""
+เปรียบเทียบการลด noise แบบ tile (run_tiled) กับการทำทั้งภาพ ทุกวิธีของ denoise.py
+- ความใกล้เคียง: ค่าต่างสูงสุด (0-255) และสัดส่วน pixel ที่ต่าง
+- ยอมให้ต่างได้ไม่เกิน TOLERANCE ระดับ (OpenCV ปัดต่างกันตามความกว้างของ array เช่น bilateral บนภาพ L)
+  เกินนี้แปลว่า halo ของวิธีนั้นไม่พอ สคริปต์จบด้วย exit code 1
+
+รันจากโฟลเดอร์ resize_api:
+    python benchmarks/denoise_tiling.py
+    python benchmarks/denoise_tiling.py --size 1500x1000 --tile 128 --image photo.jpg
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resize_router import pixel_pool  # noqa: E402
+from resize_router.denoise import DENOISE_ALGORITHMS, denoise_array, denoise_halo, plan_denoise  # noqa: E402
+
+TOLERANCE = 1
+# ความแรงต่อวิธี (bilateral ใช้ diameter 5 เมื่อเบา และ 9 เมื่อแรง)
+NOISE_REDUCTIONS = (2.0, 5.0, 10.0)
+MODES = ("L", "RGB", "RGBA")
+
+
+def sample_image(size, mode: str) -> Image.Image:
+    """ภาพทดสอบ: gradient + noise แบบ Gaussian แต่ละช่องสีต่างกัน alpha เป็น gradient"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    channels = [np.clip(x + rng.normal(0, 20, (height, width)), 0, 255) for _ in range(3)]
+    channels.append(np.broadcast_to(x, (height, width)))
+    return Image.fromarray(np.dstack(channels).astype(np.uint8)).convert(mode)
+
+
+def compare(image: Image.Image, algorithm: str, params: dict):
+    started = time.perf_counter()
+    whole = denoise_array(image, algorithm, params)
+    whole_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    tiled = pixel_pool.run_tiled(denoise_array, image, denoise_halo(algorithm, params), algorithm, params)
+    tiled_ms = (time.perf_counter() - started) * 1000
+    diff = np.abs(np.asarray(whole, dtype=np.int16) - np.asarray(tiled, dtype=np.int16))
+    return int(diff.max()), float(np.mean(diff > 0)), whole_ms, tiled_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="900x700", help="ขนาดภาพทดสอบ WxH")
+    parser.add_argument("--tile", type=int, default=128, help="ขนาด tile (เล็กกว่า IMAGE_TILE_SIZE ให้มีรอยต่อมาก)")
+    parser.add_argument("--image", help="ใช้ภาพจริงแทนภาพทดสอบ")
+    args = parser.parse_args()
+
+    pixel_pool.TILE_SIZE = args.tile
+    if args.image:
+        source = Image.open(args.image).convert("RGBA")
+    else:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+        source = sample_image((width, height), "RGBA")
+    print(f"ภาพ {source.width}x{source.height}, tile {args.tile}, ยอมให้ต่างได้ {TOLERANCE}")
+    print(f"{'mode':>5} {'algorithm':>10} {'strength':>9} {'whole ms':>9} {'tiled ms':>9} {'max diff':>9} {'changed':>9}")
+
+    failures = 0
+    for mode in MODES:
+        image = source.convert(mode)
+        image.load()
+        for algorithm in DENOISE_ALGORITHMS:
+            for noise_reduction in NOISE_REDUCTIONS:
+                params = plan_denoise(noise_reduction, algorithm, 20.0, 0.0, image.width * image.height)["params"]
+                max_diff, changed, whole_ms, tiled_ms = compare(image, algorithm, params)
+                flag = "" if max_diff <= TOLERANCE else "  <- halo ไม่พอ"
+                failures += bool(flag)
+                print(f"{mode:>5} {algorithm:>10} {noise_reduction:>9} {whole_ms:>9.1f} {tiled_ms:>9.1f} {max_diff:>9} {changed:>9.5f}{flag}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+เปรียบเทียบ engine ของ sharpen / blur: Pillow (ImageFilter เดิม) กับ OpenCV (sharpen_array)
+- ความเร็ว: เวลาเฉลี่ยต่อภาพ (ms) และอัตราเร่ง
+- ความใกล้เคียง: ค่าต่างสูงสุด / เฉลี่ยต่อ pixel (0-255) และ PSNR เทียบกับผลของ Pillow
+
+รันจากโฟลเดอร์ resize_api:
+    python benchmarks/sharpen_engines.py
+    python benchmarks/sharpen_engines.py --size 4000x3000 --repeat 3 --image photo.jpg
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resize_router.pixel_pool import (  # noqa: E402
+    calculate_sharpness_params,
+    filter_pixels,
+    pillow_filter,
+    sharpen_array,
+)
+
+SHARPNESS_LEVELS = (-2.0, -1.0, -0.5, 0.5, 1.0, 2.0)
+
+
+def sample_image(size, mode: str) -> Image.Image:
+    """ภาพทดสอบ: gradient + noise (มีทั้งขอบคมและพื้นที่เรียบ) alpha เป็น gradient"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = (x + y) / 2
+    channels = [np.clip(base + rng.normal(0, 25, (height, width)), 0, 255) for _ in range(3)]
+    channels.append(np.broadcast_to(x, (height, width)))
+    image = Image.fromarray(np.dstack(channels).astype(np.uint8))
+    return image.convert(mode)
+
+
+def timed(func, image, arg, repeat: int):
+    func(image, arg)  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func(image, arg)
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def compare(reference: Image.Image, candidate: Image.Image):
+    a = np.asarray(reference.convert(candidate.mode), dtype=np.int16)
+    b = np.asarray(candidate, dtype=np.int16)
+    diff = np.abs(a - b)
+    mse = float(np.mean(diff.astype(np.float64) ** 2))
+    psnr = float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+    return int(diff.max()), float(diff.mean()), psnr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="2000x1500", help="ขนาดภาพทดสอบ WxH")
+    parser.add_argument("--mode", default="RGBA", choices=["L", "LA", "RGB", "RGBA"])
+    parser.add_argument("--image", help="ใช้ภาพจริงแทนภาพทดสอบ")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.image:
+        image = Image.open(args.image).convert(args.mode)
+    else:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+        image = sample_image((width, height), args.mode)
+    image.load()
+    print(f"ภาพ {image.width}x{image.height} {image.mode}, repeat {args.repeat}")
+    print(f"{'sharpness':>9} {'filter':>8} {'pillow ms':>10} {'opencv ms':>10} {'speedup':>8} {'max diff':>9} {'mean diff':>10} {'PSNR dB':>8}")
+
+    for sharpness in SHARPNESS_LEVELS:
+        params = calculate_sharpness_params(sharpness)
+        reference, pillow_ms = timed(filter_pixels, image, pillow_filter(params), args.repeat)
+        candidate, opencv_ms = timed(sharpen_array, image, params, args.repeat)
+        max_diff, mean_diff, psnr = compare(reference, candidate)
+        name = "blur" if params["use_blur"] else "unsharp"
+        print(f"{sharpness:>9} {name:>8} {pillow_ms:>10.1f} {opencv_ms:>10.1f} {pillow_ms / opencv_ms:>7.1f}x {max_diff:>9} {mean_diff:>10.3f} {psnr:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+วัดหน่วยความจำที่ Python จองระหว่างรับไฟล์อัปโหลด -> decode -> encode (ไม่นับ pixel ของ Pillow ที่จองนอก Python heap)
+- upload: ไฟล์ที่ Starlette spool ไว้ (เล็กกว่า 1MB อยู่ใน memory ใหญ่กว่านั้นล้นลง disk)
+- peak: heap สูงสุดระหว่างแต่ละขั้นตอน (tracemalloc) และเทียบกับขนาดไฟล์อัปโหลด (~ จำนวนสำเนาของไฟล์)
+- held: heap ที่ยังค้างหลังจบขั้นตอน (เช่น contents ที่ request ถือไว้ตลอด)
+- output: สิ่งที่ส่งต่อ (contents ของไฟล์อัปโหลด / body ของ response) bytes อยู่ใน heap ส่วน mmap ไม่อยู่
+
+รันจากโฟลเดอร์ resize_api:
+    python benchmarks/upload_allocations.py
+    python benchmarks/upload_allocations.py --size 4000x3000 --image photo.jpg
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tracemalloc
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+import numpy as np
+from PIL import Image
+from starlette.datastructures import Headers, UploadFile
+from starlette.formparsers import MultiPartParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resize_router.engine import (  # noqa: E402
+    RESAMPLING_METHODS,
+    process_convert,
+    process_resize,
+    validate_image_file,
+)
+
+
+def sample_upload(size, image_format: str) -> bytes:
+    """ภาพทดสอบ: gradient + noise (ให้ไฟล์มีขนาดใกล้ภาพถ่ายจริง)"""
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    base = np.broadcast_to(x, (height, width))
+    array = np.dstack([np.clip(base + rng.normal(0, 20, (height, width)), 0, 255) for _ in range(3)]).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(array).save(buffer, format=image_format, quality=92)
+    return buffer.getvalue()
+
+
+def spooled_upload(data: bytes, content_type: str) -> UploadFile:
+    """UploadFile แบบเดียวกับที่ Starlette สร้างจาก multipart (spool_max_size เดียวกัน)"""
+    spool = SpooledTemporaryFile(max_size=MultiPartParser.spool_max_size)
+    spool.write(data)
+    spool.seek(0)
+    return UploadFile(file=spool, size=len(data), filename="upload", headers=Headers({"content-type": content_type}))
+
+
+def measure(step):
+    """รัน step แล้วคืน (ผลลัพธ์, peak, held) เป็น byte นับเฉพาะที่จองเพิ่มระหว่าง step"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = step()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak - baseline, current - baseline
+
+
+def run_case(name: str, data: bytes, content_type: str, width: int, height: int, repeat: int):
+    # loop เดียวตลอดการวัด (asyncio.run จองหน่วยความจำของตัวเองราว 2MB ทุกครั้ง)
+    loop = asyncio.new_event_loop()
+
+    def ingest(upload: UploadFile):
+        return loop.run_until_complete(validate_image_file(upload))
+
+    # ทุกขั้นตอนใช้ key ใหม่ (ไม่ได้ผลจาก result cache)
+    stages = [
+        ("ingest", lambda contents, i: contents),
+        ("resize -> response", lambda contents, i: process_resize(contents[0], contents[1], width, height, "jpg", RESAMPLING_METHODS["bilinear"], f"bench{i:028x}", inline=True)),
+        ("resize -> file", lambda contents, i: process_resize(contents[0], contents[1], width, height, "jpg", RESAMPLING_METHODS["bilinear"], f"bench{i:028x}", inline=False)),
+        ("convert -> response", lambda contents, i: process_convert(contents[0], "webp", None, None, 85, RESAMPLING_METHODS["bilinear"], f"bench{i:028x}", inline=True, preset="fast")),
+        ("convert -> file", lambda contents, i: process_convert(contents[0], "webp", None, None, 85, RESAMPLING_METHODS["bilinear"], f"bench{i:028x}", inline=False, preset="fast")),
+    ]
+    print(f"{name}: {len(data) / 1e6:.2f} MB {content_type}")
+    for stage, func in stages:
+        peaks, helds = [], []
+        for i in range(repeat):
+            # spool ถูกสร้างก่อนวัด (Starlette เขียนไว้แล้วก่อนเรียก handler)
+            upload = spooled_upload(data, content_type)
+            if stage == "ingest":
+                result, peak, held = measure(lambda: ingest(upload))
+            else:
+                contents = ingest(upload)
+                result, peak, held = measure(lambda: func(contents, i))
+                del contents
+            peaks.append(peak)
+            helds.append(held)
+        peak, held = min(peaks), min(helds)
+        # ข้อมูลที่ขั้นตอนส่งต่อ: contents ของ ingest หรือ body ของ response (mmap อยู่นอก Python heap)
+        output = result[0] if stage == "ingest" else result[0]["content"] if isinstance(result, tuple) else result["content"]
+        described = f"{type(output).__name__} {len(output) / 1e6:.2f} MB" if output is not None else "-"
+        print(f"  {stage:<20} peak {peak / 1e6:>7.2f} MB ({peak / len(data):>4.2f}x upload)  held {held / 1e6:>7.2f} MB  output {described}")
+    loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="3000x2000", help="ขนาดภาพทดสอบ WxH (ไฟล์ใหญ่กว่า 1MB จะล้นลง disk)")
+    parser.add_argument("--image", help="ใช้ภาพจริงแทนภาพทดสอบ")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, "rb") as f:
+            uploads = [(os.path.basename(args.image), f.read())]
+    else:
+        width, height = (int(value) for value in args.size.lower().split("x"))
+        uploads = [
+            ("spooled to disk", sample_upload((width, height), "JPEG")),
+            ("kept in memory", sample_upload((640, 480), "PNG")),
+        ]
+    for name, data in uploads:
+        image = Image.open(BytesIO(data))
+        content_type = Image.MIME[image.format]
+        run_case(name, data, content_type, max(1, image.width // 2), max(1, image.height // 2), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
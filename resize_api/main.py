@@ -1,13 +1,43 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from resize_router import router as resize_router
+from resize_router.executor import shutdown_executor
+from resize_router.pixel_pool import shutdown_pixel_pool
+from resize_router.jobs import start_job_workers, stop_job_workers
+from resize_router.http_cache import CachedStaticFiles
+from resize_router.janitor import start_cache_janitor, stop_cache_janitor
+from resize_router.ingest import FORM_OVERHEAD_BYTES, RequestSizeLimit
+from resize_router.engine import MAX_FILE_SIZE_MB
+from resize_router.batch import MAX_BATCH_REQUEST_MB
 # from resize_router import bilinear  # เปลี่ยนตาม path ที่ถูกต้องของคุณ
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # worker ของคิวงาน (job API) ทำงานบน event loop เดียวกับ app
+    start_job_workers()
+    # ลบผลลัพธ์เก่าใน cache เป็นรอบ (ไม่ลบไฟล์ใน request)
+    start_cache_janitor()
+    yield
+    await stop_cache_janitor()
+    await stop_job_workers()
+    # ปิด worker pool ของงานประมวลผลภาพ
+    shutdown_executor()
+    shutdown_pixel_pool()
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+app = FastAPI(lifespan=lifespan)
+
+# ETag + Cache-Control ให้ไฟล์ผลลัพธ์ (เปิดซ้ำได้ 304 ไม่ต้องส่ง body)
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
+
+# จำกัดขนาด body ก่อนอ่าน multipart ลง disk (ไฟล์ใหญ่เกินถูกปฏิเสธระหว่างอัปโหลด ไม่ต้องรอจนครบ)
+app.add_middleware(
+    RequestSizeLimit,
+    max_bytes=MAX_FILE_SIZE_MB * 1024 * 1024 + FORM_OVERHEAD_BYTES,
+    limits={"/api/resize/batch": MAX_BATCH_REQUEST_MB * 1024 * 1024 + FORM_OVERHEAD_BYTES},
+)
 
 # Allow frontend (React)
 app.add_middleware(
@@ -16,6 +46,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ให้ frontend อ่าน metadata ของ response แบบ return_image=true ได้
+    expose_headers=["X-Image-Width", "X-Image-Height", "X-Image-Handle", "X-Image-Params"],
 )
 
 # Include router
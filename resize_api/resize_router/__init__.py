@@ -1,9 +1,21 @@
 from .nearest import router as nearest_router
 from .bilinear import router as bilinear_router
 from .bicubic import router as bicubic_router
+from .pipeline import router as pipeline_router
+from .batch import router as batch_router
+from .variants import router as variants_router
+from .jobs import router as jobs_router
+from .method_router import create_method_router
 from fastapi import APIRouter
 
 router = APIRouter()
 router.include_router(nearest_router, prefix="/nearest")
 router.include_router(bilinear_router, prefix="/bilinear")
 router.include_router(bicubic_router, prefix="/bicubic")
+router.include_router(create_method_router("lanczos"), prefix="/lanczos")
+router.include_router(create_method_router("box"), prefix="/box")
+router.include_router(create_method_router("hamming"), prefix="/hamming")
+router.include_router(pipeline_router)
+router.include_router(batch_router)
+router.include_router(variants_router)
+router.include_router(jobs_router)
@@ -0,0 +1,249 @@
+import asyncio
+import io
+import json
+import os
+import tarfile
+import zipfile
+from typing import List, Optional
+
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
+
+from .executor import MAX_WORKERS
+from .ingest import check_image_bytes
+from .engine import MAX_FILE_SIZE_MB, RESAMPLING_METHODS, validate_image_file, run_resize
+from .result_cache import content_digest
+from .storage import get_storage
+
+router = APIRouter()
+
+# Config
+# จำนวนไฟล์สูงสุดต่อ batch (ทั้งแบบหลายไฟล์และไฟล์ใน zip / tar)
+MAX_BATCH_FILES = int(os.getenv("IMAGE_MAX_BATCH_FILES", "1000"))
+MAX_ARCHIVE_MB = int(os.getenv("IMAGE_MAX_ARCHIVE_MB", "1024"))
+# ขนาดรวมของคำขอ batch (ไฟล์ทั้งหมด + archive) ตรวจก่อนอ่าน multipart (ดู ingest.RequestSizeLimit)
+MAX_BATCH_REQUEST_MB = int(os.getenv("IMAGE_MAX_BATCH_REQUEST_MB", str(MAX_ARCHIVE_MB)))
+# จำนวนภาพที่อ่าน/ประมวลผลพร้อมกันต่อ batch (ไม่เกินจำนวน worker จึงไม่ชน MAX_PENDING ของ executor)
+BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", str(MAX_WORKERS)))
+# worker pool เต็มจากคำขออื่น (503): รอแล้วลองใหม่แบบเดียวกับ job queue แทนที่จะนับเป็นไฟล์ที่ล้มเหลว
+BATCH_BUSY_RETRIES = 30
+BATCH_OUTPUTS = ("ndjson", "zip")
+
+
+class _ChunkSink(io.RawIOBase):
+    """stream ปลายทางของ zipfile ที่เก็บ byte ไว้ให้ดึงออกไปส่งทีละก้อน (seek ไม่ได้ zipfile จะใช้ data descriptor)"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def check_archive(fileobj) -> str:
+    """ตรวจชนิดของ archive ก่อนเริ่มส่ง response (คืน "zip" หรือ "tar")"""
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        return "zip"
+    fileobj.seek(0)
+    try:
+        tarfile.open(fileobj=fileobj, mode="r:*").close()
+    except tarfile.ReadError:
+        raise HTTPException(400, "archive ต้องเป็นไฟล์ zip หรือ tar (.tar, .tar.gz)")
+    return "tar"
+
+
+def iter_archive(fileobj):
+    """
+    อ่านไฟล์ภาพใน zip หรือ tar ทีละไฟล์ (ไม่แตกทั้งก้อนลง disk / memory)
+    yield (ชื่อไฟล์, bytes) หรือ (ชื่อไฟล์, HTTPException) ถ้าไฟล์นั้นใหญ่เกิน
+    """
+    max_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    kind = check_archive(fileobj)
+    fileobj.seek(0)
+    if kind == "zip":
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if info.file_size > max_bytes:
+                    yield info.filename, HTTPException(413, f"ขนาดไฟล์ใหญ่เกินไป (สูงสุด {MAX_FILE_SIZE_MB}MB)")
+                    continue
+                with archive.open(info) as member:
+                    # อ่านไม่เกิน max_bytes + 1 กัน header ที่โกหกขนาด
+                    yield info.filename, member.read(max_bytes + 1)
+        return
+
+    with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if member.size > max_bytes:
+                yield member.name, HTTPException(413, f"ขนาดไฟล์ใหญ่เกินไป (สูงสุด {MAX_FILE_SIZE_MB}MB)")
+                continue
+            yield member.name, archive.extractfile(member).read(max_bytes + 1)
+
+
+async def iter_sources(files: List[UploadFile], archive: Optional[UploadFile]):
+    """
+    รวมแหล่งภาพของ batch: yield (ชื่อไฟล์, loader) โดย loader เป็น coroutine ที่คืน (contents, content_type)
+    ไฟล์ใน archive อ่านใน thread จึงไม่บล็อก event loop
+    """
+    count = len(files)
+    for upload in files:
+        yield upload.filename, validate_image_file(upload)
+
+    if archive is None:
+        return
+    entries = iter_archive(archive.file)
+    while True:
+        entry = await asyncio.to_thread(next, entries, None)
+        if entry is None:
+            break
+        count += 1
+        name, data = entry
+        if count > MAX_BATCH_FILES:
+            # เริ่มส่ง response ไปแล้ว จึงรายงานเป็นรายการผิดพลาดรายการสุดท้ายแทนการ raise
+            yield name, _load_member(HTTPException(400, f"ส่งได้สูงสุด {MAX_BATCH_FILES} ไฟล์ต่อ batch (ข้ามไฟล์ที่เหลือ)"))
+            break
+        yield name, _load_member(data)
+
+
+async def _load_member(data):
+    if isinstance(data, HTTPException):
+        raise data
+    return data, check_image_bytes(data, MAX_FILE_SIZE_MB * 1024 * 1024)
+
+
+async def fan_out(sources, handler):
+    """
+    เรียก handler(index, name, loader) กับทุกแหล่งภาพ พร้อมกันไม่เกิน BATCH_CONCURRENCY งาน
+    แล้ว yield ผลลัพธ์ตามลำดับที่เสร็จ (ไม่ต้องรอทั้ง batch)
+    """
+    pending = set()
+    index = 0
+    async for name, loader in sources:
+        if len(pending) >= BATCH_CONCURRENCY:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+        pending.add(asyncio.create_task(handler(index, name, loader)))
+        index += 1
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
+
+
+def entry_name(index: int, name: Optional[str], extension: str) -> str:
+    """ชื่อไฟล์ใน zip ผลลัพธ์ (ใส่ลำดับไว้หน้าชื่อ กันชื่อซ้ำระหว่างโฟลเดอร์ใน archive)"""
+    stem = os.path.splitext(os.path.basename(name or "image"))[0] or "image"
+    return f"{index:05d}_{stem}.{extension}"
+
+
+@router.post("/batch")
+async def batch_resize(
+    files: List[UploadFile] = File(None),
+    archive: Optional[UploadFile] = File(None),  # zip หรือ tar ที่มีภาพหลายไฟล์
+    width: int = Form(...),
+    height: int = Form(...),
+    method: str = Form("bicubic"),
+    target_format: Optional[str] = Form(None),
+    output: str = Form("ndjson"),  # ndjson = manifest ทีละบรรทัดพร้อม URL, zip = ไฟล์ภาพทั้งหมดใน zip
+    quality: int = Form(85, ge=1, le=100),
+    preset: str = Form("balanced")  # fast / balanced / max-compression / auto
+):
+    """
+    Resize หลายภาพในคำขอเดียวด้วย spec เดียวกัน
+    - รับหลายไฟล์ (files) และ/หรือ zip / tar (archive)
+    - ประมวลผลพร้อมกันบน worker pool และส่งผลกลับทันทีที่แต่ละภาพเสร็จ (ลำดับตามที่เสร็จ ดู index)
+    - output=ndjson: หนึ่งบรรทัดต่อภาพ (URL ใน static/cache) และบรรทัดสรุปท้ายสุด
+    - output=zip: zip แบบ streaming ของภาพผลลัพธ์ + manifest.json ท้าย zip
+    - ภาพที่ผิดพลาดไม่ทำให้ทั้ง batch ล้ม จะมี status / error ของภาพนั้นแทน
+    """
+    files = files or []
+    if not files and archive is None:
+        raise HTTPException(400, "กรุณาส่งไฟล์ภาพ (files) หรือ archive อย่างน้อยหนึ่งอย่าง")
+    if method not in RESAMPLING_METHODS:
+        raise HTTPException(400, f"method ต้องเป็นหนึ่งใน {list(RESAMPLING_METHODS)}")
+    if output not in BATCH_OUTPUTS:
+        raise HTTPException(400, f"output ต้องเป็นหนึ่งใน {list(BATCH_OUTPUTS)}")
+    if width <= 0 or height <= 0:
+        raise HTTPException(400, "width และ height ต้องมากกว่า 0")
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(400, f"ส่งได้สูงสุด {MAX_BATCH_FILES} ไฟล์ต่อ batch")
+    if archive is not None:
+        if archive.size and archive.size > MAX_ARCHIVE_MB * 1024 * 1024:
+            raise HTTPException(413, f"archive ใหญ่เกินไป (สูงสุด {MAX_ARCHIVE_MB}MB)")
+        check_archive(archive.file)
+
+    inline = output == "zip"
+
+    async def resize_when_idle(contents, content_type):
+        digest = await content_digest(contents)
+        for attempt in range(BATCH_BUSY_RETRIES + 1):
+            try:
+                return await run_resize(contents, content_type, method, width, height, target_format, inline, quality, preset, digest)
+            except HTTPException as e:
+                if e.status_code != 503 or attempt == BATCH_BUSY_RETRIES:
+                    raise
+                await asyncio.sleep(1)
+
+    async def handle(index: int, name: Optional[str], loader):
+        entry = {"index": index, "name": name}
+        try:
+            contents, content_type = await loader
+            _, result, _, content = await resize_when_idle(contents, content_type)
+            if inline and content is None:
+                # ได้ผลจาก cache: อ่านไฟล์เดิมแทนการ encode ใหม่
+                content = await asyncio.to_thread(get_storage().read, result["filename"])
+            entry.update(status=200, **result)
+        except HTTPException as e:
+            entry.update(status=e.status_code, error=e.detail)
+            content = None
+        except Exception as e:
+            entry.update(status=500, error=f"การประมวลผลภาพล้มเหลว: {str(e)}")
+            content = None
+        return entry, content
+
+    async def ndjson_stream():
+        total = failed = 0
+        async for entry, _ in fan_out(iter_sources(files, archive), handle):
+            total += 1
+            failed += entry["status"] != 200
+            yield json.dumps(entry, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "total": total, "succeeded": total - failed, "failed": failed}) + "\n"
+
+    async def zip_stream():
+        sink = _ChunkSink()
+        manifest = []
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as bundle:
+            async for entry, content in fan_out(iter_sources(files, archive), handle):
+                if content is not None:
+                    entry["entry"] = entry_name(entry["index"], entry["name"], entry["used_extension"])
+                    # ภาพ encode มาแล้ว (JPEG / PNG / WebP) ไม่ต้องบีบอัดซ้ำ
+                    bundle.writestr(entry["entry"], content)
+                manifest.append(entry)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+            manifest.sort(key=lambda item: item["index"])
+            bundle.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+        yield sink.drain()
+
+    if inline:
+        return StreamingResponse(
+            zip_stream(),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="batch.zip"'},
+        )
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
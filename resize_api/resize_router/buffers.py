@@ -0,0 +1,123 @@
+import io
+import mmap
+import os
+import tempfile
+from io import BytesIO
+from typing import Optional, Union
+
+from PIL import Image
+
+# ไฟล์ภาพที่ส่งต่อระหว่างขั้นตอน: bytes (ไฟล์เล็ก) หรือ mmap (ไฟล์อัปโหลดที่ spool ลง disk / ผล encode ใน memfd)
+ImageData = Union[bytes, mmap.mmap]
+
+
+def spooled_data(file) -> Optional[ImageData]:
+    """
+    เนื้อหาของไฟล์อัปโหลดที่ Starlette spool ไว้แล้ว (SpooledTemporaryFile) โดยไม่อ่านเป็น bytes อีกชุด
+    - ยังอยู่ใน memory (ไม่เกิน spool_max_size 1MB): bytes จาก BytesIO ของ spool
+      (ไม่ใช้ getbuffer เพราะ view ที่ค้างอยู่ทำให้ Starlette ปิดไฟล์ไม่ได้)
+    - ล้นลง disk แล้ว: mmap แบบอ่านอย่างเดียว OS โหลดหน้าเมื่อถูกอ่าน ไม่กิน heap
+      และยังใช้ได้หลังไฟล์อัปโหลดถูกปิด (เช่นงานใน job queue)
+    คืน None ถ้าไม่ใช่ไฟล์แบบ spool (ให้อ่านแบบปกติแทน)
+    """
+    inner = getattr(file, "_file", None)
+    if isinstance(inner, BytesIO):
+        return inner.getvalue()
+    if inner is None or not getattr(file, "_rolled", False):
+        return None
+    inner.flush()
+    if os.fstat(inner.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(inner.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class BufferReader(io.RawIOBase):
+    """
+    file object อ่านอย่างเดียวบน buffer (เช่น mmap) คัดลอกเฉพาะช่วงที่ถูกอ่าน
+    (BytesIO(mmap) คัดลอกทั้งไฟล์) แต่ละ reader มีตำแหน่งอ่านของตัวเอง ใช้ mmap เดียวกันพร้อมกันได้
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._position + size)
+        data = self._view[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+def open_image(data) -> Image.Image:
+    """Image.open จาก bytes / mmap โดยไม่คัดลอกทั้งไฟล์ (BytesIO(bytes) ใช้ bytes เดิมร่วมกัน)"""
+    if isinstance(data, bytes):
+        return Image.open(BytesIO(data))
+    return Image.open(BufferReader(data))
+
+
+def memory_file():
+    """
+    ไฟล์ใน RAM ที่มี fileno (memfd บน Linux ระบบอื่นใช้ไฟล์ชั่วคราว)
+    Pillow encode ลง fd ตรง ๆ (JPEG / PNG) แทนการสร้าง bytes ทีละก้อนขนาดเท่าภาพเมื่อเขียนลง BytesIO
+    """
+    if hasattr(os, "memfd_create"):
+        return open(os.memfd_create("image-output", os.MFD_CLOEXEC), "w+b")
+    return tempfile.TemporaryFile()
+
+
+def file_data(f) -> ImageData:
+    """เนื้อหาของ memory_file ที่เขียนเสร็จแล้ว map เป็น buffer (ไม่คัดลอก) แล้วปิดไฟล์ (mapping ยังอยู่)"""
+    try:
+        f.flush()
+        if f.seek(0, io.SEEK_END) == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+
+def encode_image(image: Image.Image, output_format: str, **save_params) -> ImageData:
+    """encode ภาพลง memory_file คืนเนื้อหาไฟล์เป็น mmap (ส่งเป็น body ของ response ได้โดยไม่คัดลอก)"""
+    f = memory_file()
+    try:
+        image.save(f, format=output_format, **save_params)
+    except BaseException:
+        f.close()
+        raise
+    return file_data(f)
+
+
+def portable(value):
+    """แปลง mmap ใน args / ผลลัพธ์เป็น bytes (ส่งข้าม process ด้วย pickle ไม่ได้)"""
+    if isinstance(value, mmap.mmap):
+        return bytes(value)
+    if isinstance(value, dict):
+        return {key: portable(item) for key, item in value.items()}
+    if isinstance(value, (tuple, list)):
+        return type(value)(portable(item) for item in value)
+    return value
@@ -0,0 +1,25 @@
+from typing import Optional, Tuple
+
+from PIL import Image
+
+
+def apply_jpeg_draft(image: Image.Image, target_size: Optional[Tuple[int, int]]) -> Optional[float]:
+    """
+    ตั้ง draft mode ให้ JPEG ก่อน load() เพื่อให้ libjpeg decode ที่ 1/2, 1/4 หรือ 1/8
+    (DCT scaling) เมื่อขนาดปลายทางเล็กกว่าภาพต้นฉบับมาก
+    - ต้องเรียกก่อน load() เท่านั้น
+    - Pillow เลือก scale ที่ผลลัพธ์ยังไม่เล็กกว่า target_size จึงไม่เสียความละเอียดที่ต้องใช้
+    คืนค่า scale ที่ใช้ (เช่น 0.25) หรือ None ถ้าไม่ได้ใช้ draft
+    """
+    if image.format != 'JPEG' or not target_size:
+        return None
+
+    width, height = target_size
+    if width <= 0 or height <= 0:
+        return None
+
+    original_width = image.width
+    if image.draft(image.mode, (width, height)) is None:
+        return None
+    scale = image.width / original_width
+    return scale if scale < 1 else None
@@ -0,0 +1,183 @@
+import math
+import os
+import time
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi import HTTPException
+from PIL import Image
+
+from .pixel_pool import run_pixel_stage, run_tiled, should_tile, calculate_median_kernel, median_array
+
+# Config
+AUTO_ALGORITHM = "auto"
+DENOISE_ALGORITHMS = ("median", "bilateral", "guided", "nlmeans")
+
+# วัด noise จาก patch ความละเอียดเต็ม (ย่อภาพจะเฉลี่ย noise ทิ้งไปก่อนวัด) ตาราง GRID x GRID patch
+NOISE_PATCH_SIZE = 64
+NOISE_PATCH_GRID = 6
+# สัดส่วน pixel ที่เป็นจุดขาว/ดำโดด (salt-and-pepper) เกินนี้ใช้ median
+IMPULSE_RATIO = 0.005
+# ภาพที่แทบไม่มี noise ยังลดตามความแรงที่ขอ โดยถือว่ามี noise อย่างน้อยเท่านี้
+MIN_NOISE_SIGMA = 2.0
+# sigma ของ noise ที่ต้องลด (0-255) ที่แต่ละวิธีรับได้ เรียงจากถูกไปแพง
+BILATERAL_MAX_SIGMA = 4.0
+GUIDED_MAX_SIGMA = 12.0
+# NL-means ช้ามาก: ประมาณ 1 วินาทีต่อล้าน pixel (RGB ต่อ 1 core) ภาพใหญ่กว่านี้ algorithm=auto ใช้ guided filter แทน
+# ค่าเริ่มต้น 1MP จึงรอไม่เกินราว 1 วินาที (algorithm=nlmeans ที่ระบุเองยังใช้ได้กับทุกขนาด ช้าตามจำนวน pixel)
+NLMEANS_MAX_PIXELS = int(float(os.getenv("IMAGE_NLMEANS_MAX_MEGAPIXELS", "1")) * 1_000_000)
+
+# kernel ของ Immerkaer (1996): ตอบสนองต่อ noise แต่แทบไม่ตอบสนองต่อขอบ / gradient ของภาพ
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+
+def estimate_noise(image: Image.Image) -> Tuple[float, float]:
+    """
+    ประเมิน noise จาก patch เล็ก ๆ กระจายทั่วภาพ (ไม่แปลงทั้งภาพเป็น array) คืนค่า (sigma, impulse_ratio)
+    - sigma: ส่วนเบี่ยงเบนของ noise แบบ Gaussian (0-255) ใช้ควอไทล์ที่ 25 ของทุก patch (patch ที่มี texture จะได้ค่าสูงเกินจริง)
+    - impulse_ratio: สัดส่วน pixel ที่เป็น 0/255 และต่างจาก median รอบข้างมาก
+    """
+    patch = min(NOISE_PATCH_SIZE, image.width, image.height)
+    if patch < 8:
+        return 0.0, 0.0
+    # ภาพเล็กใช้ patch น้อยลง (patch ไม่ซ้อนกันเกินจำเป็น)
+    grid = max(2, min(NOISE_PATCH_GRID, image.width // patch, image.height // patch))
+    sigmas, impulses = [], []
+    for row in range(grid):
+        for column in range(grid):
+            top = (image.height - patch) * row // (grid - 1)
+            left = (image.width - patch) * column // (grid - 1)
+            region = image.crop((left, top, left + patch, top + patch))
+            region = region.convert('RGB' if region.mode in ('RGB', 'RGBA') else 'L')
+            array = np.asarray(region)
+            channels = [array] if array.ndim == 2 else [array[..., index] for index in range(3)]
+            for channel in channels:
+                response = cv2.filter2D(channel.astype(np.float32), -1, _NOISE_KERNEL)[1:-1, 1:-1]
+                sigmas.append(math.sqrt(math.pi / 2) * float(np.abs(response).sum()) / (6 * (patch - 2) ** 2))
+                extreme = (channel <= 5) | (channel >= 250)
+                outlier = cv2.absdiff(channel, cv2.medianBlur(channel, 3)) > 60
+                impulses.append(float(np.mean(extreme & outlier)))
+    return float(np.percentile(sigmas, 25)), float(np.mean(impulses))
+
+
+def plan_denoise(noise_reduction: float, algorithm: str, sigma: float, impulse_ratio: float, pixels: int) -> dict:
+    """
+    เลือกวิธีและพารามิเตอร์ที่ถูกที่สุดที่ลด noise ได้ตามความแรงที่ขอ
+    - noise_reduction 5 = ลด noise เท่าที่วัดได้, 10 = แรงเป็นสองเท่า
+    - noise แบบจุด (salt-and-pepper): median (kernel ตาม calculate_median_kernel แบบเดิม)
+    - noise แบบ Gaussian: bilateral (เบา) -> guided filter (ปานกลาง) -> fast NL-means (แรง)
+      NL-means เฉพาะภาพไม่เกิน NLMEANS_MAX_PIXELS (ราว 1 วินาทีต่อล้าน pixel)
+    """
+    target = max(sigma, MIN_NOISE_SIGMA) * noise_reduction / 5
+    if algorithm == AUTO_ALGORITHM:
+        if impulse_ratio > IMPULSE_RATIO:
+            algorithm = "median"
+        elif target <= BILATERAL_MAX_SIGMA:
+            algorithm = "bilateral"
+        elif target <= GUIDED_MAX_SIGMA or pixels > NLMEANS_MAX_PIXELS:
+            algorithm = "guided"
+        else:
+            algorithm = "nlmeans"
+
+    if algorithm == "median":
+        params = {"kernel_size": calculate_median_kernel(noise_reduction)}
+    elif algorithm == "bilateral":
+        params = {"diameter": 5 if target <= BILATERAL_MAX_SIGMA else 9, "sigma_color": round(2.5 * target, 2), "sigma_space": 2.0}
+    elif algorithm == "guided":
+        params = {"radius": 2 if target <= GUIDED_MAX_SIGMA else 3, "eps": round((2 * target / 255) ** 2, 6)}
+    elif algorithm == "nlmeans":
+        params = {"h": round(0.8 * target, 2), "template_window": 5, "search_window": 11}
+    else:
+        raise HTTPException(400, f"algorithm ต้องเป็นหนึ่งใน {[AUTO_ALGORITHM, *DENOISE_ALGORITHMS]}")
+    return {"algorithm": algorithm, "params": params, "target_sigma": round(target, 2)}
+
+
+def denoise_halo(algorithm: str, params: dict) -> int:
+    """ขอบที่ tile ต้องมีให้แต่ละ pixel เห็นรอบข้างครบเท่าการทำทั้งภาพ (ผลอาจปัดต่างได้ 1 ระดับ ดู run_tiled)"""
+    if algorithm == "median":
+        return params["kernel_size"] // 2
+    if algorithm == "bilateral":
+        return params["diameter"] // 2
+    if algorithm == "guided":
+        return params["radius"] * 2  # box filter สองชั้น
+    return params["template_window"] // 2 + params["search_window"] // 2
+
+
+def guided_filter(array: np.ndarray, radius: int, eps: float) -> np.ndarray:
+    """guided filter (He et al.) ที่ใช้ภาพตัวเองเป็น guide ทำด้วย box filter ล้วน เวลาไม่ขึ้นกับ radius"""
+    image = array.astype(np.float32) * (1 / 255)
+    size = (2 * radius + 1, 2 * radius + 1)
+    mean = cv2.boxFilter(image, -1, size)
+    variance = cv2.boxFilter(image * image, -1, size) - mean * mean
+    a = variance / (variance + eps)
+    b = mean - a * mean
+    output = cv2.boxFilter(a, -1, size) * image + cv2.boxFilter(b, -1, size)
+    return np.clip(output * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def denoise_array(image: Image.Image, algorithm: str, params: dict) -> Image.Image:
+    """ลด noise เฉพาะช่องสีด้วย OpenCV แล้วคืน alpha เดิม (ภาพ L / RGB / RGBA)"""
+    if algorithm == "median":
+        return median_array(image, params["kernel_size"])
+
+    array = np.asarray(image)
+    # bilateral / NL-means รับได้แค่ 1 หรือ 3 ช่อง: แยกช่องสีเป็น array ต่อเนื่อง
+    color = np.ascontiguousarray(array[..., :3]) if image.mode == 'RGBA' else array
+    if algorithm == "bilateral":
+        processed = cv2.bilateralFilter(color, params["diameter"], params["sigma_color"], params["sigma_space"])
+    elif algorithm == "guided":
+        processed = guided_filter(color, params["radius"], params["eps"])
+    elif color.ndim == 3:
+        processed = cv2.fastNlMeansDenoisingColored(color, None, params["h"], params["h"], params["template_window"], params["search_window"])
+    else:
+        processed = cv2.fastNlMeansDenoising(color, None, params["h"], params["template_window"], params["search_window"])
+
+    if image.mode == 'RGBA':
+        output = np.empty_like(array)
+        output[..., :3] = processed
+        output[..., 3] = array[..., 3]
+        processed = output
+    return Image.fromarray(processed)
+
+
+def denoise_pixels(image: Image.Image, algorithm: str, params: dict) -> Image.Image:
+    """ขั้นตอน pixel ของการลด noise (ภาพใหญ่ทำทีละ tile)"""
+    if image.mode == 'LA':
+        image = image.convert('RGBA')
+    elif image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    if should_tile(image):
+        return run_tiled(denoise_array, image, denoise_halo(algorithm, params), algorithm, params)
+    return denoise_array(image, algorithm, params)
+
+
+def denoise_image(image: Image.Image, noise_reduction: float, algorithm: Optional[str] = AUTO_ALGORITHM) -> Tuple[Image.Image, dict]:
+    """
+    ลด noise แบบเลือกวิธีเอง คืนค่า (ภาพ, ข้อมูลการลด noise พร้อมเวลาที่ใช้แต่ละขั้นตอน)
+    - noise_reduction 0 = ไม่ลด noise
+    - algorithm: auto (ค่าเริ่มต้น) หรือบังคับ median / bilateral / guided / nlmeans
+    """
+    algorithm = (algorithm or AUTO_ALGORITHM).lower()
+    if algorithm != AUTO_ALGORITHM and algorithm not in DENOISE_ALGORITHMS:
+        raise HTTPException(400, f"algorithm ต้องเป็นหนึ่งใน {[AUTO_ALGORITHM, *DENOISE_ALGORITHMS]}")
+    if noise_reduction <= 0:
+        return image, {"algorithm": "none", "params": {}, "timings_ms": {}}
+
+    started = time.perf_counter()
+    sigma, impulse_ratio = estimate_noise(image)
+    estimated = time.perf_counter()
+    plan = plan_denoise(noise_reduction, algorithm, sigma, impulse_ratio, image.width * image.height)
+    processed = run_pixel_stage(denoise_pixels, image, plan["algorithm"], plan["params"])
+    finished = time.perf_counter()
+
+    return processed, {
+        **plan,
+        "requested": algorithm,
+        "noise_sigma": round(sigma, 2),
+        "impulse_ratio": round(impulse_ratio, 5),
+        "timings_ms": {
+            "estimate": round((estimated - started) * 1000, 2),
+            plan["algorithm"]: round((finished - estimated) * 1000, 2),
+        },
+    }
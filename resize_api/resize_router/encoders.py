@@ -0,0 +1,138 @@
+import os
+from typing import Optional
+
+from fastapi import HTTPException
+from PIL import Image
+
+from .buffers import ImageData, encode_image
+from .executor import MAX_WORKERS, queue_depth
+from .pixel_pool import run_pixel_stage, resize_pixels
+
+# Config
+# preset ของการ encode: แลกความเร็วกับขนาดไฟล์ (key ย่อยคือชื่อ format ของ Pillow)
+ENCODER_PRESETS = {
+    # เร็วที่สุด ไฟล์ใหญ่ขึ้น
+    "fast": {
+        "WEBP": {"method": 0},
+        "AVIF": {"speed": 10},
+        "PNG": {"compress_level": 1},
+        "JPEG": {"optimize": False, "progressive": False, "subsampling": "4:2:0"},
+    },
+    # ค่าเดิมของ resize / sharpen / enhance (WebP method 4, PNG compress_level 6)
+    "balanced": {
+        "WEBP": {"method": 4},
+        "AVIF": {"speed": 8},
+        "PNG": {"compress_level": 6},
+        "JPEG": {"optimize": True, "progressive": False, "subsampling": "4:2:0"},
+    },
+    # ไฟล์เล็กที่สุด ช้าที่สุด (WebP method 6 เดิมของ convert)
+    "max-compression": {
+        "WEBP": {"method": 6},
+        "AVIF": {"speed": 6},  # speed ต่ำกว่านี้ช้ามาก (หลายวินาทีต่อล้าน pixel)
+        "PNG": {"compress_level": 9, "optimize": True},
+        "JPEG": {"optimize": True, "progressive": True, "subsampling": "4:2:0"},
+    },
+}
+AUTO_PRESET = "auto"
+
+# ความเร็ว encode โดยประมาณ (ล้าน pixel ต่อวินาที ต่อ worker) ใช้ประเมินเวลาตอนเลือก preset แบบ auto
+ENCODE_MEGAPIXELS_PER_SECOND = {
+    "max-compression": 2.0,
+    "balanced": 8.0,
+    "fast": 30.0,
+}
+# format ที่ encode ช้ากว่า WebP / JPEG ที่ preset เดียวกัน (คูณเวลาที่ประเมิน)
+ENCODE_FORMAT_COST = {
+    "AVIF": 4.0,
+}
+# เวลา encode ที่ยอมรับได้ต่อภาพ (รวมเวลาที่ต้องแบ่ง worker กับงานในคิว)
+ENCODE_BUDGET_MS = float(os.getenv("IMAGE_ENCODE_BUDGET_MS", "250"))
+
+# การบีบอัดให้ได้ขนาดไฟล์ตาม max_bytes
+MIN_QUALITY = 10
+# ขนาดอยู่ระหว่าง SIZE_TOLERANCE * max_bytes ถึง max_bytes ถือว่าพอแล้ว หยุดค้นหาทันที
+SIZE_TOLERANCE = 0.9
+MAX_DOWNSCALE_STEPS = 5
+
+
+def resolve_preset(preset: Optional[str], pixels: int, output_format: Optional[str] = None) -> str:
+    """
+    แปลงชื่อ preset ที่ผู้ใช้ส่งมาเป็น preset จริง
+    - auto: เลือก preset ที่บีบอัดมากที่สุดที่คาดว่า encode เสร็จภายใน ENCODE_BUDGET_MS
+      โดยคิดจากจำนวน pixel ของผลลัพธ์ และจำนวนงานที่ค้างใน worker pool (queue_depth)
+    """
+    preset = (preset or "balanced").lower()
+    if preset == AUTO_PRESET:
+        # งานที่ค้างอยู่แบ่ง worker กัน คิวยิ่งยาว ยิ่งต้องใช้ preset ที่เร็วขึ้น
+        load = (1 + queue_depth() / MAX_WORKERS) * ENCODE_FORMAT_COST.get(output_format, 1.0)
+        for name in ("max-compression", "balanced"):
+            estimated_ms = pixels / 1_000_000 / ENCODE_MEGAPIXELS_PER_SECOND[name] * 1000 * load
+            if estimated_ms <= ENCODE_BUDGET_MS:
+                return name
+        return "fast"
+    if preset not in ENCODER_PRESETS:
+        raise HTTPException(400, f"preset ต้องเป็นหนึ่งใน {list(ENCODER_PRESETS) + [AUTO_PRESET]}")
+    return preset
+
+
+def encoder_params(output_format: Optional[str], preset: str, quality: Optional[int]) -> dict:
+    """พารามิเตอร์ของ Image.save() ตาม format ของ Pillow (JPEG / PNG / WEBP) และ preset ที่ resolve แล้ว"""
+    save_params = dict(ENCODER_PRESETS[preset].get(output_format, {}))
+    if output_format in ('JPEG', 'WEBP', 'AVIF') and quality is not None:
+        save_params['quality'] = quality
+    return save_params
+
+
+def encode_to_budget(image: Image.Image, output_format: str, preset: str, quality: Optional[int], max_bytes: int, allow_downscale: bool, resample: int):
+    """
+    encode ใน memory ให้ได้ไฟล์ไม่เกิน max_bytes
+    - JPEG / WebP / AVIF: bisection หา quality สูงสุดที่ไม่เกินขนาด (เริ่มจาก quality ที่ผู้ใช้ขอ)
+      หยุดทันทีเมื่อได้ขนาดอย่างน้อย SIZE_TOLERANCE ของ max_bytes
+    - PNG (lossless) ปรับ quality ไม่ได้ จะลดขนาดได้ด้วยการย่อภาพเท่านั้น
+    - allow_downscale: ถ้า quality ต่ำสุดยังเกิน ให้ย่อภาพตามสัดส่วนขนาดไฟล์แล้วค้นหาใหม่
+    คืนค่า (ไฟล์ที่ encode แล้ว (mmap), quality ที่ใช้, ภาพที่ encode, จำนวนครั้งที่ encode)
+    """
+    lossy = output_format in ('JPEG', 'WEBP', 'AVIF')
+    quality = quality or 85
+    iterations = 0
+    smallest = None
+
+    def encode(candidate: Image.Image, candidate_quality: Optional[int]) -> ImageData:
+        nonlocal iterations, smallest
+        iterations += 1
+        data = encode_image(candidate, output_format, **encoder_params(output_format, preset, candidate_quality))
+        smallest = len(data) if smallest is None else min(smallest, len(data))
+        return data
+
+    for step in range(MAX_DOWNSCALE_STEPS + 1):
+        smallest = None
+        data = encode(image, quality if lossy else None)
+        if len(data) <= max_bytes:
+            return data, quality if lossy else None, image, iterations
+
+        if lossy:
+            best = None
+            low, high = MIN_QUALITY, quality - 1
+            while low <= high:
+                middle = (low + high) // 2
+                data = encode(image, middle)
+                if len(data) <= max_bytes:
+                    best = (data, middle)
+                    if len(data) >= max_bytes * SIZE_TOLERANCE:
+                        break
+                    low = middle + 1
+                else:
+                    high = middle - 1
+            if best:
+                return best[0], best[1], image, iterations
+
+        if not allow_downscale or step == MAX_DOWNSCALE_STEPS:
+            raise HTTPException(
+                400,
+                f"ไม่สามารถบีบอัดให้ไม่เกิน {max_bytes:,} bytes ได้ (เล็กสุด {smallest:,} bytes) "
+                "ลองเพิ่ม max_bytes หรือส่ง allow_downscale=true"
+            )
+        # ขนาดไฟล์แปรผันตามจำนวน pixel โดยประมาณ: ย่อแต่ละด้านตาม sqrt ของอัตราส่วน (เผื่อไว้ 5%)
+        scale = max(0.25, min(0.9, (max_bytes / smallest) ** 0.5 * 0.95))
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = run_pixel_stage(resize_pixels, image, size, resample)
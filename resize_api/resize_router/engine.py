@@ -0,0 +1,444 @@
+import asyncio
+import json
+import mmap
+from fastapi import UploadFile, HTTPException
+from fastapi.responses import Response
+from typing import Optional
+from PIL import Image
+from pathlib import Path
+from .executor import run_image_task
+from .pixel_pool import run_pixel_stage, resize_pixels, sharpen_pixels, calculate_sharpness_params
+from .denoise import AUTO_ALGORITHM, denoise_image
+from .ingest import read_image_upload, probe_dimensions
+from .buffers import ImageData, open_image, encode_image
+from .decode import apply_jpeg_draft
+from .encoders import resolve_preset, encoder_params, encode_to_budget
+from .result_cache import get_result_cache, content_digest, make_cache_key, cache_filename, cache_url
+from .storage import get_storage
+from .http_cache import CACHE_CONTROL_IMMUTABLE
+from .handles import ImageRecord, image_handles, decoded_images, load_record_image
+from .formats import INPUT_CONTENT_TYPES, OUTPUT_FORMATS, SOURCE_EXTENSIONS
+
+# Config
+MAX_FILE_SIZE_MB = 10
+# content type ที่รับได้ -> นามสกุลผลลัพธ์เริ่มต้น (รวม HEIC / AVIF เมื่อมี decoder ดู formats.py)
+ALLOWED_CONTENT_TYPES = INPUT_CONTENT_TYPES
+
+# วิธี resample ที่รองรับ (ชื่อ method = prefix ของ route เช่น /api/resize/lanczos/)
+RESAMPLING_METHODS = {
+    "nearest": Image.NEAREST,
+    "bilinear": Image.BILINEAR,
+    "bicubic": Image.BICUBIC,
+    "lanczos": Image.LANCZOS,
+    "box": Image.BOX,
+    "hamming": Image.HAMMING,
+}
+
+# สร้างโฟลเดอร์ static หากไม่มี
+Path("static").mkdir(exist_ok=True)
+
+async def validate_image_file(file: UploadFile):
+    """
+    ใช้ไฟล์อัปโหลดจาก spool ของ Starlette โดยตรง (bytes หรือ mmap ไม่คัดลอกอีกชุด) พร้อมตรวจสอบ
+    - ชนิดไฟล์จาก magic bytes (JPEG / PNG / WebP)
+    - ขนาดไฟล์ไม่เกิน MAX_FILE_SIZE_MB
+    - ขนาดภาพจาก header (กัน decompression bomb)
+    คืนค่า (contents, content_type ที่ตรวจพบจริง)
+    """
+    return await read_image_upload(file, MAX_FILE_SIZE_MB * 1024 * 1024)
+
+def get_record(handle: str) -> ImageRecord:
+    """ตรวจ handle คืน ImageRecord (404 ถ้าไม่ถูกต้องหรือหมดอายุ) ยังไม่โหลดภาพ"""
+    record = image_handles.get(handle)
+    if record is None:
+        raise HTTPException(404, "ไม่พบภาพของ handle นี้ (อาจหมดอายุแล้ว) กรุณา resize ใหม่")
+    return record
+
+async def get_source_image(handle: str):
+    """หาภาพต้นทางจาก handle คืนค่า (record, image)"""
+    record = get_record(handle)
+    return record, await load_source_image(record)
+
+async def load_source_image(record: ImageRecord) -> Image.Image:
+    """
+    ภาพต้นทางของ record
+    - ใช้ภาพที่ decode ไว้แล้วใน memory ถ้ามี
+    - ไม่มี (ครั้งแรก / ถูก evict / handle จาก worker อื่น) จะ decode จากไฟล์ใน storage แล้วเก็บไว้
+    """
+    image = decoded_images.get(record.key)
+    if image is None:
+        if record.filename is None or not await asyncio.to_thread(get_storage().exists, record.filename):
+            raise HTTPException(404, "ภาพของ handle นี้ไม่อยู่ในหน่วยความจำแล้ว กรุณา resize ใหม่")
+        image = await run_image_task(load_record_image, record.filename)
+        decoded_images.put(record.key, image)
+    return image
+
+def image_format(extension: str) -> Optional[str]:
+    """ชื่อ format ของ Pillow จากนามสกุล (เช่น jpg -> JPEG)"""
+    return Image.registered_extensions().get(f".{extension.lower()}")
+
+def save_output(image: Image.Image, prefix: str, cache_key: str, extension: str, inline: bool, **save_params):
+    """
+    encode ภาพผลลัพธ์ลงปลายทางโดยตรง คืนค่า (filename, content)
+    - ปกติ: เขียนลง storage (ไฟล์ชั่วคราวแล้ว rename) แล้วคืน (filename, None)
+    - inline: encode ลงไฟล์ใน RAM (memfd) คืน (None, mmap) เป็น body ของ response ของ POST ได้เลยโดยไม่คัดลอก
+    """
+    if inline:
+        return None, encode_image(image, image_format(extension), **save_params)
+    filename = cache_filename(prefix, cache_key, extension)
+    with get_storage().open_write(filename) as f:
+        image.save(f, format=image_format(extension), **save_params)
+    return filename, None
+
+def write_output(data: ImageData, prefix: str, cache_key: str, extension: str, inline: bool):
+    """เหมือน save_output แต่รับ bytes ที่ encode ไว้แล้ว (ไม่ต้อง encode ซ้ำ)"""
+    if inline:
+        return None, data
+    filename = cache_filename(prefix, cache_key, extension)
+    get_storage().write(filename, data)
+    return filename, None
+
+def prepare_output(image: Image.Image, extension: str, quality: int = 85, preset: str = "balanced"):
+    """
+    เตรียมภาพสำหรับ encode ตามรูปแบบไฟล์ คืนค่า (ภาพ, save_params)
+    - JPEG: วางบนพื้นขาวถ้ามี alpha
+    - พารามิเตอร์ encode ตาม preset (ดู encoders.ENCODER_PRESETS)
+    """
+    output_format = image_format(extension)
+    save_params = encoder_params(output_format, preset, quality)
+    if output_format == 'JPEG':
+        if image.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    return image, save_params
+
+# field ที่ไม่ต้องใส่ใน X-Image-Params (มี header ของตัวเองหรือไม่เกี่ยวกับ response แบบภาพ)
+IMAGE_RESPONSE_SKIP_FIELDS = ("filename", "url", "handle", "width", "height")
+
+def image_response(result: dict, extension: str, content: Optional[ImageData] = None, extra_headers: Optional[dict] = None) -> Response:
+    """
+    ส่งภาพผลลัพธ์กลับใน body ของ POST (return_image=true) แทน JSON + URL
+    - Content-Type ตามรูปแบบไฟล์ ขนาดภาพอยู่ใน X-Image-Width / X-Image-Height
+    - handle สำหรับขั้นตอนถัดไปอยู่ใน X-Image-Handle พารามิเตอร์อื่นอยู่ใน X-Image-Params (JSON)
+    - ถ้าเป็นผลจาก cache ส่งไฟล์เดิมจาก storage ไม่ต้อง encode ใหม่
+      (S3: 303 ไปที่ URL ของ object ไม่อ่านผ่าน API header X-Image-* อยู่ใน response 303)
+    """
+    params = {k: v for k, v in result.items() if k not in IMAGE_RESPONSE_SKIP_FIELDS}
+    headers = {
+        "X-Image-Width": str(result["width"]),
+        "X-Image-Height": str(result["height"]),
+        "X-Image-Params": json.dumps(params, default=str),
+    }
+    if result.get("handle"):
+        headers["X-Image-Handle"] = result["handle"]
+    headers.update(extra_headers or {})
+    media_type = Image.MIME.get(image_format(extension), "application/octet-stream")
+    if content is not None:
+        if isinstance(content, mmap.mmap):
+            content = memoryview(content)  # Response รับ memoryview เป็น body ได้โดยไม่คัดลอก
+        return Response(content, media_type=media_type, headers=headers)
+    return get_storage().response(result["filename"], media_type, headers)
+
+def process_resize(contents: ImageData, content_type: str, width: int, height: int, target_format: Optional[str], resample: int, cache_key: str, inline: bool = False, quality: int = 85, preset: str = "balanced"):
+    """งาน CPU ของ resize_image (รันใน worker pool ผ่าน run_image_task)"""
+    # กำหนดนามสกุลไฟล์ผลลัพธ์
+    extension = target_format.lower() if target_format else ALLOWED_CONTENT_TYPES.get(content_type, 'webp')
+
+    # เปิดภาพด้วย Pillow ด้วยการจัดการข้อผิดพลาดเฉพาะ
+    try:
+        image = open_image(contents)
+        # JPEG ที่ย่อลงมาก: ให้ libjpeg decode ที่ scale เล็กลงเลย (ลด CPU และ RAM)
+        apply_jpeg_draft(image, (width, height))
+        
+        # แปลงโหมดสีสำหรับ WebP โดยไม่ขึ้นกับ mode เดิม
+        if image.format == 'WEBP':
+            if image.mode == 'P':
+                image = image.convert('RGBA')
+            elif image.mode == 'LA':
+                image = image.convert('RGBA')
+            elif image.mode == 'L':
+                image = image.convert('RGB')
+        
+        image.load()  # บังคับโหลดข้อมูล
+    except Exception as e:
+        raise HTTPException(400, f"ไม่สามารถเปิดไฟล์ภาพได้: {str(e)}")
+
+    # Resize ภาพ
+    resized = run_pixel_stage(resize_pixels, image, (width, height), resample)
+
+    # จัดการโหมดสีก่อนบันทึก
+    if extension == 'webp':
+        # ไม่บังคับแปลงโหมดสีสำหรับ WebP
+        pass
+    elif extension in ['jpg', 'jpeg']:
+        if resized.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', resized.size, (255, 255, 255))
+            background.paste(resized, mask=resized.split()[-1])
+            resized = background
+        elif resized.mode not in ('RGB', 'L'):
+            resized = resized.convert('RGB')
+
+    # ตั้งค่าการบันทึกไฟล์ตาม preset
+    save_params = encoder_params(image_format(extension), preset, quality)
+
+    # การตั้งค่าเฉพาะสำหรับ WebP
+    if extension == 'webp':
+        save_params['lossless'] = False
+        
+        # ลองบันทึกด้วยวิธีต่างๆ หากวิธีหลักล้มเหลว
+        try:
+            filename, content = save_output(resized, "resize", cache_key, extension, inline, **save_params)
+        except:
+            try:
+                # ลองบันทึกแบบ RGB หาก RGBA ล้มเหลว
+                if resized.mode == 'RGBA':
+                    temp_img = resized.convert('RGB')
+                    filename, content = save_output(temp_img, "resize", cache_key, extension, inline, **save_params)
+                else:
+                    raise
+            except:
+                # ลองบันทึกแบบไม่มีพารามิเตอร์
+                filename, content = save_output(resized, "resize", cache_key, extension, inline)
+
+    else:
+        # การตั้งค่าสำหรับรูปแบบอื่น
+        filename, content = save_output(resized, "resize", cache_key, extension, inline, **save_params)
+
+    return {
+        "filename": filename,
+        "url": cache_url(filename) if filename else None,
+        "source_extension": SOURCE_EXTENSIONS.get(content_type),
+        "used_extension": extension,
+        "quality": quality,
+        "preset": preset,
+        "width": resized.width,
+        "height": resized.height,
+        "content": content,
+    }, resized
+
+async def run_resize(contents: ImageData, content_type: str, method: str, width: int, height: int, target_format: Optional[str], inline: bool = False, quality: int = 85, preset: str = "balanced", digest: Optional[str] = None):
+    """
+    resize ผ่าน result cache (ใช้ร่วมกันระหว่าง resize_image และ batch)
+    digest: content_digest ของ contents ถ้าคำนวณไว้แล้ว (เช่นตอนเลือก format แบบ auto)
+    คืนค่า (cache_key, result, resized, content) โดย resized / content เป็น None เมื่อได้ผลจาก cache
+    """
+    cache = get_result_cache()
+    digest = digest or await content_digest(contents)
+    # key ใช้ preset ที่ resolve แล้ว (auto ขึ้นกับคิวงาน key เดียวต้องได้ไฟล์เดิมทุกครั้ง ETag ถึงเป็น strong ได้)
+    extension = target_format.lower() if target_format else ALLOWED_CONTENT_TYPES.get(content_type, 'webp')
+    encoder = resolve_preset(preset, width * height, image_format(extension))
+    cache_key = make_cache_key(digest, "resize", method=method, width=width, height=height, target_format=target_format, quality=quality, preset=encoder)
+    result = await cache.get(cache_key)
+    resized = content = None
+    if result is None:
+        result, resized = await run_image_task(process_resize, contents, content_type, width, height, target_format, RESAMPLING_METHODS[method], cache_key, inline, quality, encoder)
+        content = result.pop("content")
+        if result["filename"]:
+            await cache.put(cache_key, result["filename"], result)
+    return cache_key, result, resized, content
+
+def process_convert(contents: ImageData, target_format: str, width: Optional[int], height: Optional[int], quality: Optional[int], resample: int, cache_key: str, inline: bool = False, preset: str = "max-compression", max_bytes: Optional[int] = None, allow_downscale: bool = False):
+    """งาน CPU ของ convert_image (รันใน worker pool ผ่าน run_image_task)"""
+    # แปลงชื่อรูปแบบ (jpg / png / webp และ avif ถ้า Pillow encode ได้)
+    format_mapping = OUTPUT_FORMATS
+
+    target_format = target_format.lower()
+    if target_format not in format_mapping:
+        raise HTTPException(400, "รูปแบบไฟล์ปลายทางไม่รองรับ")
+
+    output_format = format_mapping[target_format]
+
+    # เปิดภาพด้วย Pillow
+    try:
+        image = open_image(contents)
+        if width and height:
+            apply_jpeg_draft(image, (width, height))
+        # สำหรับไฟล์ WebP
+        if image.format == 'WEBP' and image.mode == 'P':
+            image = image.convert('RGBA')
+        image.load()
+    except Exception as e:
+        raise HTTPException(400, f"ไม่สามารถเปิดภาพได้: {str(e)}")
+
+    # Resize ถ้ามี
+    if width and height:
+        image = run_pixel_stage(resize_pixels, image, (width, height), resample)
+
+    # แปลงโหมดสีสำหรับ JPEG
+    if output_format == 'JPEG':
+        if image.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+    # สำหรับ WebP ให้ตรวจสอบโหมดสี
+    if output_format == 'WEBP' and image.mode == 'P':
+        image = image.convert('RGBA')
+
+    # Save (ใช้ค่าคุณภาพที่ผู้ใช้กำหนด + พารามิเตอร์ตาม preset)
+    save_params = encoder_params(output_format, preset, quality)
+    if output_format == 'TIFF':
+        save_params['compression'] = 'tiff_deflate'
+
+    extension_map = {
+        'JPEG': 'jpg',
+        'PNG': 'png',
+        'WEBP': 'webp',
+        'AVIF': 'avif',
+    }
+    extension = extension_map.get(output_format, target_format)
+
+    iterations = None
+    if max_bytes:
+        # หา quality (และขนาดภาพถ้ายอมให้ย่อ) ที่ได้ไฟล์ไม่เกิน max_bytes ใน memory แล้วเขียนผลครั้งเดียว
+        data, quality, image, iterations = encode_to_budget(image, output_format, preset, quality, max_bytes, allow_downscale, resample)
+        filename, content = write_output(data, "converted", cache_key, extension, inline)
+    else:
+        filename, content = save_output(image, "converted", cache_key, extension, inline, **save_params)
+
+    return {
+        "filename": filename,
+        "url": cache_url(filename) if filename else None,
+        "format": extension,
+        "quality": quality if output_format in ['JPEG', 'WEBP', 'AVIF'] else None,
+        "preset": preset,
+        "max_bytes": max_bytes,
+        "iterations": iterations,
+        "cache_control": CACHE_CONTROL_IMMUTABLE,  # header ที่ /static/cache ส่งจริง
+        "width": image.width,
+        "height": image.height,
+        "content": content,
+    }
+
+async def run_convert(contents: ImageData, method: str, target_format: str, width: Optional[int], height: Optional[int], quality: Optional[int], inline: bool = False, preset: str = "auto", max_bytes: Optional[int] = None, allow_downscale: bool = False, digest: Optional[str] = None):
+    """
+    convert ผ่าน result cache (ใช้ร่วมกันระหว่าง convert_image และ job queue)
+    digest: content_digest ของ contents ถ้าคำนวณไว้แล้ว
+    คืนค่า (cache_key, result, content) โดย content เป็น None เมื่อได้ผลจาก cache หรือไม่ได้ขอ inline
+    """
+    cache = get_result_cache()
+    digest = digest or await content_digest(contents)
+    # preset ที่ resolve แล้วเป็นส่วนหนึ่งของ key (เหมือน run_resize)
+    size = (width, height) if width and height else probe_dimensions(contents) or (0, 0)
+    encoder = resolve_preset(preset, size[0] * size[1], OUTPUT_FORMATS.get(target_format.lower()))
+    cache_key = make_cache_key(digest, "convert", method=method, target_format=target_format.lower(), width=width, height=height, quality=quality, preset=encoder, max_bytes=max_bytes, allow_downscale=allow_downscale)
+    result = await cache.get(cache_key)
+    content = None
+    if result is None:
+        result = await run_image_task(process_convert, contents, target_format, width, height, quality, RESAMPLING_METHODS[method], cache_key, inline, encoder, max_bytes, allow_downscale)
+        content = result.pop("content")
+        if result["filename"]:
+            await cache.put(cache_key, result["filename"], result)
+    return cache_key, result, content
+
+def process_sharpen(image: Image.Image, filename: Optional[str], extension: str, sharpness: float, cache_key: str, encode: bool = True, inline: bool = False, quality: int = 85, preset: str = "balanced"):
+    """งาน CPU ของ sharpen_image (รันใน worker pool ผ่าน run_image_task)"""
+    # คำนวณพารามิเตอร์จากค่า sharpness
+    params = calculate_sharpness_params(sharpness)
+
+    if image.mode == 'P':
+        image = image.convert('RGBA')  # ป้องกัน palette-based
+
+    # ตรวจสอบว่ามีช่อง alpha (พื้นหลังโปร่งใส)
+    has_alpha = image.mode in ('RGBA', 'LA')
+
+    # >>> ทำ sharpen หรือ blur ตามค่าที่ได้รับ (sharpen_pixels แยก alpha ไว้ให้เอง)
+    processed = run_pixel_stage(sharpen_pixels, image, params, sharpness)
+
+    result = {
+        "filename": None,
+        "url": None,
+        "cache_control": CACHE_CONTROL_IMMUTABLE,  # header ที่ /static/cache ส่งจริง
+        "extension": extension,
+        "sharpness": sharpness,
+        "source_filename": filename,
+        "has_alpha": has_alpha,
+        "image_mode": processed.mode,
+        "encoded": encode,
+        "quality": quality,
+        "preset": preset,
+        "params": params,  # สำหรับ debug
+        "width": processed.width,
+        "height": processed.height,
+        "content": None,
+    }
+    if not encode:
+        # ขั้นตอนกลาง: เก็บ pixel ไว้ใน RAM อย่างเดียว ไม่ encode / ไม่เขียนไฟล์
+        return result, processed
+
+    # ตั้งค่าการบันทึกตามประเภทไฟล์ (แปลงเฉพาะภาพที่จะ encode ภาพใน RAM คงความละเอียดเดิม)
+    output = processed
+    save_params = encoder_params(image_format(extension), preset, quality)
+    if extension in ['jpg', 'jpeg']:
+        if output.mode == 'RGBA':
+            output = output.convert('RGB')  # JPEG ไม่รองรับ alpha
+    # WebP / PNG รองรับ RGBA ได้โดยตรง
+
+    # บันทึกภาพที่ประมวลผลแล้ว (ชื่อไฟล์ตาม cache key หรือส่งกลับใน response เลยถ้า inline)
+    new_filename, content = save_output(output, "sharpen", cache_key, extension, inline, **save_params)
+
+    result.update({
+        "filename": new_filename,
+        "url": cache_url(new_filename) if new_filename else None,
+        "image_mode": output.mode,
+        "content": content,
+    })
+    return result, processed
+
+def process_enhance(image: Image.Image, extension: str, noise_reduction: float, cache_key: str, encode: bool = True, inline: bool = False, quality: int = 85, preset: str = "balanced", algorithm: str = AUTO_ALGORITHM):
+    """งาน CPU ของ enhance_image (รันใน worker pool ผ่าน run_image_task)"""
+    # Convert palette images to RGBA
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+
+    # จัดการ alpha channel
+    has_alpha = image.mode in ('RGBA', 'LA')
+
+    # วัด noise ก่อน แล้วเลือกวิธีที่ถูกที่สุดที่ลดได้ตามความแรงที่ขอ (alpha คงไว้ใน array เดียวกัน)
+    processed, denoise = denoise_image(image, noise_reduction, algorithm)
+    kernel_size = denoise["params"].get("kernel_size")
+    action = "noise_reduction"
+
+    result = {
+        "filename": None,
+        "url": None,
+        "extension": extension,
+        "noise_reduction": noise_reduction,
+        "kernel_size": kernel_size,  # มีค่าเฉพาะเมื่อใช้ median
+        "algorithm": denoise["algorithm"],
+        "denoise": denoise,  # ค่า noise ที่วัดได้ พารามิเตอร์ และเวลาที่ใช้แต่ละขั้นตอน (ms)
+        "action": action,
+        "has_alpha": has_alpha,
+        "encoded": encode,
+        "quality": quality,
+        "preset": preset,
+        "message": f"ปรับปรุงภาพสำเร็จ: {action} ({denoise['algorithm']})",
+        "width": processed.width,
+        "height": processed.height,
+        "content": None,
+    }
+    if not encode:
+        # ขั้นตอนกลาง: เก็บ pixel ไว้ใน RAM อย่างเดียว
+        return result, processed
+
+    # ตั้งค่าการบันทึกตามประเภทไฟล์
+    output = processed
+    save_params = encoder_params(image_format(extension), preset, quality)
+    if extension in ['jpg', 'jpeg']:
+        if output.mode == 'RGBA':
+            output = output.convert('RGB')
+
+    # บันทึกไฟล์ (ตาม cache key) หรือส่งกลับใน response เลยถ้า inline
+    new_filename, content = save_output(output, "enhanced", cache_key, extension, inline, **save_params)
+
+    result.update({
+        "filename": new_filename,
+        "url": cache_url(new_filename) if new_filename else None,
+        "content": content,
+    })
+    return result, processed
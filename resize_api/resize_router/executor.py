@@ -0,0 +1,76 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+from fastapi import HTTPException
+
+from .buffers import portable
+from .pixel_pool import mark_pool_worker
+
+# Config (ปรับได้ผ่าน environment variable)
+# IMAGE_EXECUTOR: "thread" (ค่าเริ่มต้น) หรือ "process"
+EXECUTOR_KIND = os.getenv("IMAGE_EXECUTOR", "thread").lower()
+MAX_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 2)))
+# จำนวนงานสูงสุดที่รอ + กำลังทำอยู่ เกินกว่านี้ตอบ 503 ทันที
+MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", str(MAX_WORKERS * 4)))
+
+_executor: Optional[Executor] = None
+_pending = 0
+
+
+def _run_portable(func, *args, **kwargs):
+    """รันใน worker process: แปลง mmap ในผลลัพธ์เป็น bytes ก่อน pickle กลับ"""
+    return portable(func(*args, **kwargs))
+
+
+def get_executor() -> Executor:
+    """สร้าง executor ที่ใช้ร่วมกันทุก router (สร้างครั้งแรกที่เรียกใช้)"""
+    global _executor
+    if _executor is None:
+        if EXECUTOR_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=mark_pool_worker)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="image")
+    return _executor
+
+
+def queue_depth() -> int:
+    """จำนวนงานภาพที่อยู่ใน pool ตอนนี้ (รอ + กำลังทำ)"""
+    return _pending
+
+
+async def run_image_task(func, *args, **kwargs):
+    """
+    รันงาน CPU-bound (Pillow/OpenCV/save) ใน worker pool แทน event loop
+    - ถ้างานค้างเกิน MAX_PENDING จะตอบ 503 เพื่อไม่ให้ latency พุ่ง
+    - func ต้องเป็นฟังก์ชันระดับ module (ส่งข้าม process ได้)
+    - backend "process": mmap (ไฟล์อัปโหลด / ผล encode) ใน args และผลลัพธ์ถูกแปลงเป็น bytes
+    """
+    global _pending
+    if _pending >= MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="เซิร์ฟเวอร์กำลังประมวลผลภาพเต็มกำลัง กรุณาลองใหม่อีกครั้ง",
+            headers={"Retry-After": "1"},
+        )
+
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        if EXECUTOR_KIND == "process":
+            task = partial(_run_portable, func, *portable(args), **portable(kwargs))
+        else:
+            task = partial(func, *args, **kwargs)
+        return await loop.run_in_executor(get_executor(), task)
+    finally:
+        _pending -= 1
+
+
+def shutdown_executor():
+    """ปิด pool ตอน app shutdown"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,63 @@
+from PIL import Image, features
+
+# HEIC / HEIF (ภาพจากมือถือ) ใช้ pillow_heif ถ้าติดตั้งไว้
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+# AVIF: Pillow 11.2+ มี plugin ในตัว (ทั้ง decode และ encode)
+AVIF_SUPPORTED = features.check("avif") and ".avif" in Image.registered_extensions()
+
+# brand ใน ftyp box (byte 8-12) -> content type
+HEIF_BRANDS = {
+    b"heic": "image/heic",
+    b"heix": "image/heic",
+    b"heim": "image/heic",
+    b"heis": "image/heic",
+    b"hevc": "image/heic",
+    b"hevx": "image/heic",
+    b"mif1": "image/heif",
+    b"msf1": "image/heif",
+}
+AVIF_BRANDS = {
+    b"avif": "image/avif",
+    b"avis": "image/avif",
+}
+
+# content type ที่รับเป็น input ได้ -> นามสกุลผลลัพธ์เริ่มต้น (HEIC เปิดใน browser ไม่ได้จึงแปลงเป็น jpg)
+INPUT_CONTENT_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+# content type ที่รับเป็น input ได้ -> นามสกุลของไฟล์ต้นฉบับ (รายงานใน source_extension)
+SOURCE_EXTENSIONS = dict(INPUT_CONTENT_TYPES)
+if HEIF_SUPPORTED:
+    INPUT_CONTENT_TYPES.update({"image/heic": "jpg", "image/heif": "jpg"})
+    SOURCE_EXTENSIONS.update({"image/heic": "heic", "image/heif": "heif"})
+if AVIF_SUPPORTED:
+    INPUT_CONTENT_TYPES["image/avif"] = "avif"
+    SOURCE_EXTENSIONS["image/avif"] = "avif"
+
+# นามสกุลที่ encode เป็นผลลัพธ์ได้ -> ชื่อ format ของ Pillow
+OUTPUT_FORMATS = {
+    "jpg": "JPEG",
+    "jpeg": "JPEG",
+    "png": "PNG",
+    "webp": "WEBP",
+}
+if AVIF_SUPPORTED:
+    OUTPUT_FORMATS["avif"] = "AVIF"
+
+
+def supported_input_names() -> str:
+    """รายชื่อรูปแบบที่รับได้ สำหรับข้อความ error"""
+    names = ["JPEG", "PNG", "WebP"]
+    if HEIF_SUPPORTED:
+        names.append("HEIC/HEIF")
+    if AVIF_SUPPORTED:
+        names.append("AVIF")
+    return ", ".join(names)
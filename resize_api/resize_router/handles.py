@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+from .result_cache import make_cache_key
+from .storage import get_storage
+
+# Config
+HANDLE_TTL_SECONDS = int(os.getenv("IMAGE_HANDLE_TTL_SECONDS", "3600"))
+# กุญแจ HMAC ของ handle ต้องเหมือนกันทุก worker / ทุกเครื่อง (ตั้งเองเมื่อรันหลายเครื่อง เช่นใช้ S3)
+# ถ้าไม่ตั้ง จะสุ่มครั้งแรกแล้วเก็บไว้ใน HANDLE_SECRET_FILE ให้ทุก worker บนเครื่องเดียวกันใช้ร่วมกัน
+HANDLE_SECRET = os.getenv("IMAGE_HANDLE_SECRET", "")
+HANDLE_SECRET_FILE = os.getenv("IMAGE_HANDLE_SECRET_FILE", ".handle_secret")
+# หน่วยความจำสูงสุดสำหรับภาพที่ decode แล้ว (นับจาก width * height * จำนวนช่องสี)
+DECODED_CACHE_MAX_BYTES = int(os.getenv("DECODED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def image_nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class DecodedImageCache:
+    """
+    cache ภาพที่ decode แล้วใน memory (LRU จำกัดเป็น byte)
+    key คือ key ของภาพใน handle (ImageRecord.key) ทำให้ resize -> sharpen -> enhance
+    ไม่ต้อง decode ไฟล์เดิมซ้ำ และขั้นตอนกลางแบบ encode=false ใช้ pixel ใน RAM ต่อกันได้เลย
+    """
+
+    def __init__(self, max_bytes: int = DECODED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key: str, image: Image.Image):
+        size = image_nbytes(image)
+        if size > self.max_bytes:
+            return  # ใหญ่เกินกว่าจะเก็บ
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self.total_bytes -= image_nbytes(old)
+            self._images[key] = image
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self.total_bytes -= image_nbytes(evicted)
+
+    def __len__(self):
+        return len(self._images)
+
+
+decoded_images = DecodedImageCache()
+
+
+class ImageRecord:
+    """ข้อมูลของภาพหนึ่งภาพที่อ้างถึงด้วย handle"""
+
+    def __init__(self, key: str, filename: Optional[str], extension: str):
+        self.key = key  # cache key ของผลลัพธ์ ใช้หาภาพใน decoded_images และทำ key ของขั้นตอนถัดไป
+        self.filename = filename  # ชื่อไฟล์ใน storage, None = ยังไม่เคย encode (ขั้นตอนกลางที่อยู่ใน RAM อย่างเดียว)
+        self.extension = extension
+
+
+def load_handle_secret() -> bytes:
+    """
+    กุญแจ HMAC: IMAGE_HANDLE_SECRET หรือไฟล์ HANDLE_SECRET_FILE (สร้างครั้งแรกแบบ atomic
+    worker ที่เริ่มพร้อมกันได้กุญแจเดียวกัน)
+    """
+    if HANDLE_SECRET:
+        return HANDLE_SECRET.encode()
+    if not os.path.exists(HANDLE_SECRET_FILE):
+        temp_path = f"{HANDLE_SECRET_FILE}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(secrets.token_hex(32))
+        os.chmod(temp_path, 0o600)
+        try:
+            os.link(temp_path, HANDLE_SECRET_FILE)  # ล้มเหลวถ้า worker อื่นสร้างไปก่อนแล้ว
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    with open(HANDLE_SECRET_FILE) as f:
+        return f.read().strip().encode()
+
+
+class ImageHandles:
+    """
+    handle แบบบอกข้อมูลในตัว: (key, ชื่อไฟล์, นามสกุล, เวลาที่ออก) + ลายเซ็น HMAC
+    - ไม่มี registry ใน memory: worker / process ไหนก็ตรวจ handle แล้วโหลดภาพจาก storage ได้
+      (uvicorn --workers N หรือหลายเครื่องที่ใช้ S3 ร่วมกัน) และไม่มีเพดานจำนวน handle
+    - แก้ข้อมูลใน handle ไม่ได้โดยไม่มีกุญแจ ผู้ที่ได้ handle จาก resize เท่านั้นที่ใช้ภาพนั้นต่อได้
+    - หมดอายุเมื่อออกมาเกิน HANDLE_TTL_SECONDS (ทุกขั้นตอนคืน handle ใหม่ ใช้ต่อกันได้เรื่อยๆ)
+    - ภาพต้นทางของขั้นตอนถัดไปมีแบบเดียวต่อ key (key ของขั้นตอนถัดไปสร้างจาก key นี้):
+      มีไฟล์ = ภาพที่ decode จากไฟล์ใน storage (flatten / ผ่าน encode แล้ว เหมือนกันทุก worker)
+      ไม่มีไฟล์ (encode=false / return_image) = pixel ใน RAM ใช้ key แยกจากแบบที่อ่านจากไฟล์
+    - decoded_images เป็นทางลัด: เก็บภาพที่ decode จากไฟล์แล้ว หรือ pixel ใน RAM ของภาพที่ไม่มีไฟล์
+    """
+
+    def __init__(self, ttl_seconds: int = HANDLE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._secret = None
+        self._lock = threading.Lock()
+
+    def create(self, key: str, filename: Optional[str], extension: str, image: Optional[Image.Image] = None) -> str:
+        """image: pixel ก่อน encode ใช้เป็นต้นทางเฉพาะเมื่อไม่มีไฟล์ (มีไฟล์แล้วให้ขั้นตอนถัดไป decode จากไฟล์)"""
+        if filename is None:
+            key = make_cache_key(key, "memory")
+            if image is not None:
+                decoded_images.put(key, image)
+        payload = f"{key}|{filename or ''}|{extension}|{int(time.time())}".encode()
+        return f"{_encode(payload)}.{_encode(self._sign(payload))}"
+
+    def get(self, handle: str) -> Optional[ImageRecord]:
+        try:
+            encoded_payload, signature = handle.split(".")
+            payload = _decode(encoded_payload)
+            if not hmac.compare_digest(_decode(signature), self._sign(payload)):
+                return None
+            key, filename, extension, issued = payload.decode().split("|")
+            if time.time() - int(issued) > self.ttl_seconds:
+                return None
+        except ValueError:  # รูปแบบผิด / base64 เสีย
+            return None
+        return ImageRecord(key, filename or None, extension)
+
+    def _sign(self, payload: bytes) -> bytes:
+        if self._secret is None:
+            with self._lock:
+                if self._secret is None:
+                    self._secret = load_handle_secret()
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()[:16]
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+image_handles = ImageHandles()
+
+
+def load_record_image(filename: str) -> Image.Image:
+    """decode ภาพจากไฟล์ใน storage (ใช้ตอนที่ record ยังไม่มีภาพใน memory)"""
+    with get_storage().open(filename) as f:
+        image = Image.open(f)
+        image.load()
+    if image.mode == 'P':
+        return image.convert('RGBA')  # ป้องกัน palette-based
+    return image
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from .storage import CACHE_DIR
+
+# Config
+# ไฟล์ใน cache ตั้งชื่อจาก hash ของ input + พารามิเตอร์ (ชื่อเดิม = เนื้อหาเดิมเสมอ) จึง cache ได้ถาวร
+CACHE_CONTROL_IMMUTABLE = "public, max-age=31536000, immutable"
+# ไฟล์อื่นใน static (ชื่อไม่ได้มาจาก hash) ให้ browser ตรวจ ETag ซ้ำหลังหมดอายุ
+CACHE_CONTROL_DEFAULT = f"public, max-age={int(os.getenv('IMAGE_STATIC_MAX_AGE', '600'))}"
+MAX_ETAG_ENTRIES = 4096
+
+# ชื่อไฟล์จาก result_cache.cache_filename: <prefix>_<key 32 หลัก>.<ext>
+CACHE_FILENAME_PATTERN = re.compile(r"^[a-z]+_([0-9a-f]{32})\.[a-z0-9]+$")
+
+_etags = OrderedDict()  # (path, size, mtime_ns) -> etag ของไฟล์ที่ไม่ได้ตั้งชื่อจาก hash
+_etags_lock = threading.Lock()
+
+
+def is_content_addressed(path: str) -> bool:
+    """ไฟล์อยู่ใน cache (โฟลเดอร์ย่อยตาม hash) และชื่อไฟล์เป็น hash (เนื้อหาไม่มีวันเปลี่ยนสำหรับชื่อเดิม)"""
+    path = os.path.abspath(path)
+    root = os.path.abspath(CACHE_DIR)
+    return os.path.commonpath([path, root]) == root and CACHE_FILENAME_PATTERN.match(os.path.basename(path)) is not None
+
+
+def strong_etag(path: str, stat_result: os.stat_result) -> str:
+    """
+    ETag แบบ strong (ไม่ขึ้นกับ mtime ไฟล์ชื่อเดิมถูกเขียนใหม่ได้หลังถูก evict โดยเนื้อหาเท่าเดิม)
+    - ไฟล์ใน cache: ใช้ hash ในชื่อไฟล์ได้เลย ไม่ต้องอ่านไฟล์
+    - ไฟล์อื่น: sha256 ของเนื้อหา จำไว้ตามขนาด + mtime
+    """
+    match = CACHE_FILENAME_PATTERN.match(os.path.basename(path))
+    if match and is_content_addressed(path):
+        return f'"{match.group(1)}"'
+
+    key = (os.path.abspath(path), stat_result.st_size, stat_result.st_mtime_ns)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag is not None:
+            _etags.move_to_end(key)
+            return etag
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    etag = f'"{digest.hexdigest()[:32]}"'
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > MAX_ETAG_ENTRIES:
+            _etags.popitem(last=False)
+    return etag
+
+
+def cache_headers(path: str, stat_result: os.stat_result) -> dict:
+    """ETag + Cache-Control สำหรับไฟล์ผลลัพธ์"""
+    return {
+        "ETag": strong_etag(path, stat_result),
+        "Cache-Control": CACHE_CONTROL_IMMUTABLE if is_content_addressed(path) else CACHE_CONTROL_DEFAULT,
+    }
+
+
+def is_not_modified(request_headers: Headers, etag: str) -> bool:
+    """If-None-Match ตรงกับ ETag ปัจจุบัน (ไม่ดู If-Modified-Since เพราะ mtime เปลี่ยนเมื่อเขียนไฟล์ชื่อเดิมใหม่)"""
+    if_none_match = request_headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def cached_file_response(path: str, request_headers: Headers, media_type: str = None, status_code: int = 200) -> Response:
+    """FileResponse พร้อม ETag / Cache-Control ตอบ 304 (ไม่มี body) ถ้า client มีไฟล์นี้อยู่แล้ว"""
+    stat_result = os.stat(path)
+    headers = cache_headers(path, stat_result)
+    if is_not_modified(request_headers, headers["ETag"]):
+        return NotModifiedResponse(Headers(headers))
+    return FileResponse(path, status_code=status_code, media_type=media_type, headers=headers, stat_result=stat_result)
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles ที่ส่ง ETag แบบ strong และ Cache-Control ตามชนิดไฟล์
+    - ไฟล์ใน static/cache: immutable (ชื่อไฟล์เปลี่ยนเมื่อเนื้อหาเปลี่ยน)
+    - If-None-Match ตรงกัน: 304 ไม่ส่ง body (เปิดซ้ำไม่เสีย bandwidth)
+    """
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        return cached_file_response(str(full_path), Headers(scope=scope), status_code=status_code)
@@ -0,0 +1,153 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from .buffers import ImageData, open_image, spooled_data
+from .formats import HEIF_BRANDS, AVIF_BRANDS, INPUT_CONTENT_TYPES, supported_input_names
+
+# Config
+# จำนวน pixel สูงสุดที่ยอมให้ decode (กัน decompression bomb)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+# ส่วนของ multipart นอกจากตัวไฟล์ (boundary, header ของแต่ละ part, field อื่น ๆ) ที่ยอมให้เกินขนาดไฟล์
+FORM_OVERHEAD_BYTES = 1024 * 1024
+
+# magic bytes -> content type
+IMAGE_SIGNATURES = (
+    (0, b'\xff\xd8\xff', "image/jpeg"),
+    (0, b'\x89PNG\r\n\x1a\n', "image/png"),
+)
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """ตรวจชนิดไฟล์จาก magic bytes ต้นไฟล์ (ไม่เชื่อ content-type ที่ client ส่งมา)"""
+    for offset, signature, content_type in IMAGE_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return "image/webp"
+    # HEIF / AVIF (ISO BMFF): ftyp box ตั้งแต่ byte 4 และ major brand ที่ byte 8
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        return HEIF_BRANDS.get(brand) or AVIF_BRANDS.get(brand)
+    return None
+
+
+def probe_dimensions(data) -> Optional[Tuple[int, int]]:
+    """อ่านขนาดภาพจาก header เท่านั้น (Image.open ยังไม่ decode pixel)"""
+    try:
+        with open_image(data) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        raise HTTPException(413, "ขนาดภาพ (จำนวน pixel) ใหญ่เกินกว่าที่รองรับ")
+    except Exception:
+        # อ่าน header ไม่ได้ (ให้ไปแจ้งตอน decode)
+        return None
+
+
+def check_dimensions(size: Tuple[int, int]):
+    width, height = size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"ขนาดภาพใหญ่เกินไป ({width}x{height}) สูงสุด {MAX_IMAGE_PIXELS:,} pixel"
+        )
+
+
+def too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"ขนาดไฟล์ใหญ่เกินไป (สูงสุด {max_bytes // (1024 * 1024)}MB)"
+    )
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware จำกัดขนาด body ของคำขอ ก่อนที่ Starlette จะอ่าน multipart ลง spool
+    (Starlette ไม่จำกัดขนาด part ที่เป็นไฟล์ handler จะเห็นไฟล์หลังอัปโหลดครบแล้วเท่านั้น)
+    - Content-Length เกิน: ตอบ 413 ทันทีโดยไม่อ่าน body
+    - ไม่มี Content-Length (chunked) หรือส่งเกินที่บอก: นับ byte ที่อ่านจริง เกินเมื่อไรหยุดอ่านแล้วตอบ 413
+    - limits: prefix ของ path -> จำนวน byte (ใช้ prefix ที่ยาวที่สุดที่ตรง) นอกนั้นใช้ max_bytes
+    """
+
+    def __init__(self, app, max_bytes: int, limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.limits = sorted((limits or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    def limit_for(self, path: str) -> int:
+        for prefix, max_bytes in self.limits:
+            if path.startswith(prefix):
+                return max_bytes
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        max_bytes = self.limit_for(scope["path"])
+        error = too_large(max_bytes - FORM_OVERHEAD_BYTES)
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > max_bytes:
+                response = JSONResponse({"detail": error.detail}, status_code=413, headers={"Connection": "close"})
+                return await response(scope, receive, send)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # FastAPI ส่ง HTTPException ที่เกิดระหว่างอ่าน form ออกไปเป็น response 413
+                    raise error
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except HTTPException as e:
+            if e is not error or started:
+                raise
+            response = JSONResponse({"detail": error.detail}, status_code=413, headers={"Connection": "close"})
+            await response(scope, receive, send)
+
+
+async def read_image_upload(file: UploadFile, max_bytes: int) -> Tuple[ImageData, str]:
+    """
+    ใช้ไฟล์ที่ Starlette spool ไว้แล้วโดยตรงแทนการอ่านเป็น bytes อีกชุด (ดู buffers.spooled_data)
+    - ขนาดทั้งคำขอถูกจำกัดก่อน spool แล้ว (RequestSizeLimit) ที่นี่ตรวจขนาดของแต่ละไฟล์จาก spool
+    - ตรวจ magic bytes (JPEG / PNG / WebP / HEIC / AVIF) และขนาดภาพจาก header ก่อน decode จริง
+    - ไฟล์แบบอื่นที่ไม่ใช่ spool อ่านทั้งไฟล์แบบเดิม
+    คืนค่า (contents เป็น bytes หรือ mmap, content_type ที่ตรวจพบ)
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise too_large(max_bytes)
+    data = spooled_data(file.file)
+    if data is None:
+        await file.seek(0)
+        data = await file.read(max_bytes + 1)
+    return data, check_image_bytes(data, max_bytes)
+
+
+def check_image_bytes(data: ImageData, max_bytes: int) -> str:
+    """
+    ตรวจภาพที่อยู่ใน memory แล้ว (ไฟล์อัปโหลด หรือไฟล์ใน zip / tar ของ batch)
+    คืนค่า content_type ที่ตรวจพบ
+    """
+    if len(data) > max_bytes:
+        raise too_large(max_bytes)
+    content_type = sniff_image_type(bytes(data[:12]))
+    if content_type not in INPUT_CONTENT_TYPES:
+        raise HTTPException(400, f"ไฟล์ไม่ใช่ภาพที่รองรับ ({supported_input_names()})")
+    size = probe_dimensions(data)
+    if size:
+        check_dimensions(size)
+    return content_type
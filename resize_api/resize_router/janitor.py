@@ -0,0 +1,91 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from .result_cache import RESULT_CACHE_TTL_SECONDS, ResultCache, get_result_cache
+
+# Config
+# รอบการทำงานของ janitor (ถูกปลุกก่อนกำหนดเมื่อ cache เกิน quota)
+JANITOR_INTERVAL_SECONDS = float(os.getenv("IMAGE_JANITOR_INTERVAL_SECONDS", "60"))
+# ไฟล์ใน cache ที่ไม่อยู่ใน index ของ process นี้ และไม่ถูกใช้ (mtime) นานกว่านี้ถือเป็นไฟล์กำพร้า
+# ค่าเริ่มต้นเท่า TTL ของ cache: ไฟล์ใน index ของ process อื่น (uvicorn --workers N) ที่ยังมีคนใช้จะไม่ถูกลบ
+ORPHAN_GRACE_SECONDS = float(os.getenv("IMAGE_ORPHAN_GRACE_SECONDS", str(RESULT_CACHE_TTL_SECONDS)))
+
+
+class CacheJanitor:
+    """
+    งานเบื้องหลังที่ดูแลพื้นที่ของ result cache แทนการลบไฟล์ใน request
+    - ลบผลลัพธ์ที่หมดอายุ (TTL) และที่ทำให้ขนาดรวมเกิน quota (LRU)
+    - ลบไฟล์กำพร้าที่ไม่มีใน index (เช่น encode ไม่สำเร็จ หรือ process ถูกปิดกลางคัน)
+    - การ scan / ลบไฟล์ (local หรือ S3) รันใน thread แยก ไม่บล็อก event loop
+    """
+
+    def __init__(self, cache: Optional[ResultCache] = None, interval: float = JANITOR_INTERVAL_SECONDS, orphan_grace: float = ORPHAN_GRACE_SECONDS):
+        self.cache = cache
+        self.interval = interval
+        self.orphan_grace = orphan_grace
+        self.last_sweep = None  # สถิติของรอบล่าสุด
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        if self._task:
+            return
+        self.cache = self.cache or get_result_cache()
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        # put() อาจถูกเรียกจาก thread อื่น จึงปลุกผ่าน call_soon_threadsafe
+        self.cache.wake = lambda: loop.call_soon_threadsafe(self._wakeup.set)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self.cache.wake = None
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                self.last_sweep = await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print(f"Cache janitor error: {e}")
+
+    def sweep(self) -> dict:
+        """หนึ่งรอบของการเก็บกวาด คืนสถิติ"""
+        started = time.time()
+        removed = self.cache.release(self.cache.collect(started))
+
+        orphans = [
+            (filename, modified) for filename, modified in self.cache.storage.scan()
+            if started - modified > self.orphan_grace and not self.cache.is_live(filename)
+        ]
+        orphans_removed = self.cache.release(orphans)
+
+        return {
+            "removed": removed,
+            "orphans_removed": orphans_removed,
+            "entries": len(self.cache),
+            "total_bytes": self.cache.total_bytes,
+            "duration_ms": round((time.time() - started) * 1000, 2),
+            "finished": time.time(),
+        }
+
+
+cache_janitor = CacheJanitor()
+
+
+def start_cache_janitor():
+    cache_janitor.start()
+
+
+async def stop_cache_janitor():
+    await cache_janitor.stop()
@@ -0,0 +1,336 @@
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+
+from .executor import MAX_WORKERS
+from .storage import get_storage
+from .http_cache import cached_file_response
+from .negotiate import AUTO_FORMAT, negotiate_format
+from .result_cache import content_digest
+from .engine import RESAMPLING_METHODS, validate_image_file, run_resize, run_convert
+
+router = APIRouter()
+
+# Config
+# จำนวน job ที่ทำพร้อมกัน (งานภาพจริงยังวิ่งบน worker pool ของ executor)
+JOB_CONCURRENCY = int(os.getenv("IMAGE_JOB_CONCURRENCY", str(MAX_WORKERS)))
+# job ที่รอคิวได้สูงสุด เกินนี้ตอบ 503 (เหมือน MAX_PENDING ของ executor)
+MAX_QUEUED_JOBS = int(os.getenv("IMAGE_MAX_QUEUED_JOBS", "256"))
+# เก็บสถานะ job ที่จบแล้วไว้ให้ poll ได้นานเท่านี้
+JOB_TTL_SECONDS = int(os.getenv("IMAGE_JOB_TTL_SECONDS", "3600"))
+MAX_JOBS = int(os.getenv("IMAGE_MAX_JOBS", "1000"))
+# ถ้า worker pool เต็ม (503) job จะรอแล้วลองใหม่ แทนที่จะล้มทันที
+JOB_BUSY_RETRIES = 30
+SSE_KEEPALIVE_SECONDS = 15
+
+JOB_TERMINAL = ("done", "failed")
+
+
+class Job:
+    """สถานะของงานหนึ่งงานในคิว"""
+
+    def __init__(self, kind: str, work, priority: int, sequence: int):
+        self.id = secrets.token_urlsafe(16)
+        self.kind = kind
+        self.priority = priority
+        self.sequence = sequence  # ลำดับที่ส่งเข้าคิว (priority เท่ากันทำตามลำดับนี้)
+        self.status = "queued"  # queued -> running -> done / failed
+        # queued -> processing (-> waiting_for_worker) -> done / failed
+        # งานภาพทั้งหมด (decode / process / encode) อยู่ใน worker pool ครั้งเดียว จึงไม่มีขั้นตอนย่อยให้รายงาน
+        self.stage = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.work = work  # coroutine function ที่คืน result (dict แบบเดียวกับ response ของ endpoint แบบ sync)
+        self.version = 0  # เพิ่มทุกครั้งที่สถานะเปลี่ยน (SSE ใช้ตรวจว่าพลาดการเปลี่ยนแปลงไปหรือไม่)
+        self._changed = asyncio.Event()
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.version += 1
+        # ปลุก SSE ที่รออยู่ แล้วเริ่ม event ใหม่สำหรับการเปลี่ยนแปลงครั้งถัดไป
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_changed(self, version: int, timeout: float) -> bool:
+        """รอจนสถานะเปลี่ยนจาก version ที่ส่งมา (คืนทันทีถ้าเปลี่ยนไปแล้ว) คืน False เมื่อหมดเวลา"""
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "priority": self.priority,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    คิวงานใน process (asyncio.PriorityQueue) พร้อม worker JOB_CONCURRENCY ตัว
+    - priority น้อย = ทำก่อน, priority เท่ากันทำตามลำดับที่ส่ง
+    - สถานะ job อยู่ใน memory (OrderedDict) ลบ job ที่จบแล้วเมื่อเกิน JOB_TTL_SECONDS หรือ MAX_JOBS
+    """
+
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, max_queued: int = MAX_QUEUED_JOBS):
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self._jobs = OrderedDict()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+        self._sequence = itertools.count()
+
+    def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, kind: str, work, priority: int) -> Job:
+        if self._queue is None:
+            raise HTTPException(503, "คิวงานยังไม่พร้อมใช้งาน")
+        if self._queue.qsize() >= self.max_queued:
+            raise HTTPException(
+                status_code=503,
+                detail="คิวงานเต็ม กรุณาลองใหม่อีกครั้ง",
+                headers={"Retry-After": "5"},
+            )
+        self._prune()
+        job = Job(kind, work, priority, next(self._sequence))
+        self._jobs[job.id] = job
+        self._queue.put_nowait((priority, job.sequence, job))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def position(self, job: Job) -> Optional[int]:
+        """
+        ลำดับของ job ในคิว (1 = ตัวถัดไปที่จะเริ่ม) ตาม priority แล้วตามลำดับที่ส่ง
+        None ถ้า job เริ่มทำแล้ว (job ที่ priority สูงกว่าส่งเข้ามาทีหลังแซงได้ ค่านี้จึงเพิ่มขึ้นได้)
+        """
+        if job.status != "queued":
+            return None
+        order = (job.priority, job.sequence)
+        return 1 + sum(
+            1 for other in self._jobs.values()
+            if other.status == "queued" and (other.priority, other.sequence) < order
+        )
+
+    def describe(self, job: Job) -> dict:
+        """สถานะของ job พร้อมลำดับในคิว (ใช้ทั้ง poll และ SSE)"""
+        return {**job.to_dict(), "queue_position": self.position(job)}
+
+    def _prune(self):
+        now = time.time()
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            expired = job.status in JOB_TERMINAL and now - job.finished > JOB_TTL_SECONDS
+            if expired or (len(self._jobs) >= MAX_JOBS and job.status in JOB_TERMINAL):
+                del self._jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job):
+        job.update(status="running", stage="processing", started=time.time())
+        try:
+            await self._attempt(job)
+        finally:
+            # ไม่ต้องใช้ work อีก: ปล่อย closure ที่อ้างถึงไฟล์อัปโหลด (job ยังอยู่ให้ poll ได้ถึง JOB_TTL_SECONDS)
+            job.work = None
+
+    async def _attempt(self, job: Job):
+        for attempt in range(JOB_BUSY_RETRIES + 1):
+            try:
+                result = await job.work()
+                job.update(status="done", stage="done", result=result, finished=time.time())
+                return
+            except HTTPException as e:
+                if e.status_code == 503 and attempt < JOB_BUSY_RETRIES:
+                    # worker pool เต็มจากคำขอแบบ sync: รอแล้วลองใหม่
+                    job.update(stage="waiting_for_worker")
+                    await asyncio.sleep(1)
+                    job.update(stage="processing")
+                    continue
+                job.update(status="failed", stage="failed", error={"status": e.status_code, "detail": e.detail}, finished=time.time())
+                return
+            except Exception as e:
+                job.update(status="failed", stage="failed", error={"status": 500, "detail": f"การประมวลผลภาพล้มเหลว: {str(e)}"}, finished=time.time())
+                return
+
+
+job_queue = JobQueue()
+
+
+def start_job_workers():
+    job_queue.start()
+
+
+async def stop_job_workers():
+    await job_queue.stop()
+
+
+def accepted(job: Job) -> JSONResponse:
+    """ตอบ 202 พร้อม URL สำหรับ poll / SSE / ดึงผลลัพธ์"""
+    base = f"/api/resize/jobs/{job.id}"
+    return JSONResponse(
+        {
+            **job_queue.describe(job),
+            "status_url": base,
+            "events_url": f"{base}/events",
+            "result_url": f"{base}/result",
+        },
+        status_code=202,
+        headers={"Location": base},
+    )
+
+
+@router.post("/jobs/resize")
+async def submit_resize_job(
+    request: Request,
+    file: UploadFile = File(...),
+    width: int = Form(...),
+    height: int = Form(...),
+    method: str = Form("bicubic"),
+    target_format: Optional[str] = Form(None),
+    quality: int = Form(85, ge=1, le=100),
+    preset: str = Form("balanced"),  # fast / balanced / max-compression / auto
+    priority: int = Form(5, ge=0, le=9)  # 0 = ด่วนที่สุด
+):
+    """ส่งงาน resize เข้าคิว ตอบ 202 พร้อม job id ทันที (ไม่ถือ connection ระหว่างประมวลผล)"""
+    if method not in RESAMPLING_METHODS:
+        raise HTTPException(400, f"method ต้องเป็นหนึ่งใน {list(RESAMPLING_METHODS)}")
+    # ต้องอ่านไฟล์ก่อนตอบ 202 (ไฟล์อัปโหลดจะถูกปิดเมื่อคำขอจบ)
+    contents, content_type = await validate_image_file(file)
+    digest = await content_digest(contents)
+    if target_format and target_format.lower() == AUTO_FORMAT:
+        # เลือกรูปแบบตอนส่งงาน (Accept ของคำขอนี้) ผลลัพธ์ดึงผ่าน result_url / URL ใน result
+        target_format = await negotiate_format(request, contents, content_type, digest)
+
+    async def work():
+        _, result, _, _ = await run_resize(contents, content_type, method, width, height, target_format, quality=quality, preset=preset, digest=digest)
+        return result
+
+    return accepted(job_queue.submit("resize", work, priority))
+
+
+@router.post("/jobs/convert")
+async def submit_convert_job(
+    request: Request,
+    file: UploadFile = File(...),
+    target_format: str = Form(...),
+    width: Optional[int] = Form(None),
+    height: Optional[int] = Form(None),
+    quality: Optional[int] = Form(85),
+    method: str = Form("bicubic"),
+    preset: str = Form("auto"),  # auto = เลือกระดับการบีบอัดจากขนาดภาพและคิวงาน (ตอนที่ job เริ่มทำ)
+    max_bytes: Optional[int] = Form(None, gt=0),
+    allow_downscale: bool = Form(False),
+    priority: int = Form(5, ge=0, le=9)
+):
+    """ส่งงาน convert (เช่น WebP method 6 ที่ใช้เวลานาน) เข้าคิว ตอบ 202 พร้อม job id ทันที"""
+    if method not in RESAMPLING_METHODS:
+        raise HTTPException(400, f"method ต้องเป็นหนึ่งใน {list(RESAMPLING_METHODS)}")
+    contents, content_type = await validate_image_file(file)
+    digest = await content_digest(contents)
+    if target_format.lower() == AUTO_FORMAT:
+        target_format = await negotiate_format(request, contents, content_type, digest)
+
+    async def work():
+        _, result, _ = await run_convert(contents, method, target_format, width, height, quality, preset=preset, max_bytes=max_bytes, allow_downscale=allow_downscale, digest=digest)
+        return result
+
+    return accepted(job_queue.submit("convert", work, priority))
+
+
+def get_job(job_id: str) -> Job:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(404, "ไม่พบ job นี้ (อาจหมดอายุแล้ว)")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """สถานะของ job (poll)"""
+    return JSONResponse(job_queue.describe(get_job(job_id)))
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-Sent Events ของ job: ส่งสถานะทุกครั้งที่เปลี่ยน จนกว่าจะ done / failed
+    ส่ง comment keepalive ทุก SSE_KEEPALIVE_SECONDS วินาทีระหว่างรอ
+    """
+    job = get_job(job_id)
+
+    async def stream():
+        while True:
+            # จำ version พร้อมกับสถานะที่ส่ง: การเปลี่ยนแปลงระหว่าง yield กับ wait_changed จะไม่หลุด
+            # และตัดสินใจจบจากสถานะที่ส่งไปแล้ว client จึงได้ event สุดท้าย (done / failed) เสมอ
+            version = job.version
+            status = job_queue.describe(job)
+            yield f"event: status\ndata: {json.dumps(status, ensure_ascii=False)}\n\n"
+            if status["status"] in JOB_TERMINAL:
+                return
+            while not await job.wait_changed(version, SSE_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, request: Request):
+    """ไฟล์ผลลัพธ์ของ job ที่เสร็จแล้ว (409 ถ้ายังไม่เสร็จ)"""
+    job = get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(job.error["status"], job.error["detail"])
+    if job.status != "done":
+        raise HTTPException(409, f"job ยังไม่เสร็จ (สถานะ: {job.status})")
+    storage = get_storage()
+    filename = job.result["filename"]
+    if not await asyncio.to_thread(storage.exists, filename):
+        raise HTTPException(410, "ไฟล์ผลลัพธ์ถูกลบออกจาก cache แล้ว กรุณาส่งงานใหม่")
+    path = storage.local_path(filename)
+    if path is None:
+        # storage ภายนอก (S3): ให้ client ดึงจาก URL ของ storage โดยตรง
+        return RedirectResponse(storage.url(filename), status_code=303)
+    return cached_file_response(path, request.headers)
@@ -0,0 +1,206 @@
+from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+from typing import Optional
+from .executor import run_image_task
+from .pixel_pool import SHARPEN_ENGINE
+from .result_cache import get_result_cache, content_digest, make_cache_key
+from .handles import image_handles
+from .encoders import resolve_preset
+from .negotiate import AUTO_FORMAT, negotiate_format
+from .preview import PREVIEW_HEADERS, run_sharpen_preview, run_enhance_preview
+from .engine import (
+    RESAMPLING_METHODS, validate_image_file, get_record, get_source_image,
+    run_resize, run_convert, process_sharpen, process_enhance, image_response, image_format,
+)
+
+
+def create_method_router(method: str) -> APIRouter:
+    """
+    สร้าง router ของ method หนึ่ง (resize / convert / sharpen / enhance_image)
+    ทุก method ใช้ engine เดียวกัน ต่างกันแค่ค่า resample จาก RESAMPLING_METHODS
+    """
+    if method not in RESAMPLING_METHODS:
+        raise ValueError(f"ไม่รู้จัก resampling method: {method}")
+    router = APIRouter()
+
+    @router.post("/")
+    async def resize_image(
+        request: Request,
+        file: UploadFile = File(...),
+        width: int = Form(...),
+        height: int = Form(...),
+        target_format: Optional[str] = Form(None),  # auto = เลือกจาก Accept header และเนื้อหาภาพ
+        return_image: bool = Form(False),  # True = ส่งไฟล์ภาพกลับใน response เลย (ไม่ต้อง GET URL อีกรอบ)
+        quality: int = Form(85, ge=1, le=100),
+        preset: str = Form("balanced")  # fast / balanced / max-compression / auto
+    ):
+        """Resize ภาพและแปลงรูปแบบ (เวอร์ชันรองรับ WebP ทุกประเภท)"""
+        try:
+            # อ่านไฟล์แบบ streaming พร้อมตรวจ header / ขนาด ก่อน decode
+            contents, content_type = await validate_image_file(file)
+            # hash ไฟล์ครั้งเดียว (ใน thread) ใช้ทั้งเลือก format และ cache key
+            digest = await content_digest(contents)
+
+            # target_format=auto: ผลลัพธ์ขึ้นกับ Accept จึง cache แยกตามรูปแบบที่เลือกได้ และตอบ Vary: Accept
+            negotiated = bool(target_format) and target_format.lower() == AUTO_FORMAT
+            if negotiated:
+                target_format = await negotiate_format(request, contents, content_type, digest)
+            vary = {"Vary": "Accept"} if negotiated else None
+
+            # input + พารามิเตอร์เดิม → ส่ง URL ผลลัพธ์เดิมกลับทันที ไม่ต้อง decode
+            cache_key, result, resized, content = await run_resize(contents, content_type, method, width, height, target_format, return_image, quality, preset, digest)
+
+            # handle สำหรับ sharpen / enhance ต่อ (เก็บภาพที่ resize แล้วไว้ใน memory)
+            result["handle"] = image_handles.create(cache_key, result["filename"], result["used_extension"], resized)
+            if return_image:
+                return image_response(result, result["used_extension"], content, vary)
+            return JSONResponse(result, headers=vary)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(500, f"การประมวลผลภาพล้มเหลว: {str(e)}")
+
+    @router.post("/convert")
+    async def convert_image(
+        request: Request,
+        file: UploadFile = File(...),
+        target_format: str = Form(...),  # auto = เลือกจาก Accept header และเนื้อหาภาพ
+        width: Optional[int] = Form(None),
+        height: Optional[int] = Form(None),
+        quality: Optional[int] = Form(85),  # เพิ่มพารามิเตอร์คุณภาพ
+        return_image: bool = Form(False),
+        preset: str = Form("auto"),  # auto = เลือกระดับการบีบอัดจากขนาดภาพและคิวงาน
+        max_bytes: Optional[int] = Form(None, gt=0),  # ขนาดไฟล์สูงสุดที่ต้องการ (ค้นหา quality ให้อัตโนมัติ)
+        allow_downscale: bool = Form(False)  # ยอมย่อภาพถ้า quality ต่ำสุดยังเกิน max_bytes
+    ):
+        """
+        แปลงรูปแบบไฟล์ภาพ
+        - max_bytes: bisection หา quality สูงสุดที่ได้ไฟล์ไม่เกินขนาดนี้ (ใน memory) ตอบจำนวนรอบใน iterations
+        """
+        try:
+            contents, content_type = await validate_image_file(file)
+            digest = await content_digest(contents)
+
+            negotiated = target_format.lower() == AUTO_FORMAT
+            if negotiated:
+                target_format = await negotiate_format(request, contents, content_type, digest)
+            vary = {"Vary": "Accept"} if negotiated else None
+
+            _, result, content = await run_convert(contents, method, target_format, width, height, quality, return_image, preset, max_bytes, allow_downscale, digest)
+
+            if return_image:
+                return image_response(result, result["format"], content, vary)
+            return JSONResponse(result, headers=vary)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(500, f"การแปลงไฟล์ล้มเหลว: {str(e)}")
+
+    @router.post("/sharpen")
+    async def sharpen_image(
+        handle: str = Form(...),  # handle ที่ได้จาก resize
+        sharpness: float = Form(0.0, ge=-2.0, le=2.0),  # รับค่า sharpness (-2 ถึง 2)
+        encode: bool = Form(True),  # False = ขั้นตอนกลาง ไม่ต้อง encode เป็นไฟล์
+        return_image: bool = Form(False),  # True = ส่งไฟล์ภาพกลับใน response เลย
+        quality: int = Form(85, ge=1, le=100),
+        preset: str = Form("balanced"),  # fast / balanced / max-compression / auto
+        preview: bool = Form(False)  # True = ทำบนภาพย่อขนาดจอ ส่งภาพกลับเลย (สำหรับ slider)
+    ):
+        """
+        ปรับความคมชัดของภาพตามค่า sharpness (-2 ถึง 2)
+        - ค่าลบ = ลดความคมชัด (blur)
+        - ค่าบวก = เพิ่มความคมชัด (sharpen)
+        - 0 = ไม่ทำอะไร
+        - รองรับภาพโปร่งใส (RGBA)
+        - encode=false: เก็บผลไว้ใน RAM อย่างเดียว แล้วส่ง handle ต่อให้ขั้นตอนถัดไป
+        - return_image=true: ส่งไฟล์ภาพกลับใน body (metadata อยู่ใน header X-Image-*)
+        - preview=true: ทำบนภาพ proxy ขนาดจอแล้ว encode แบบเร็ว ส่งภาพกลับใน body เสมอ
+          (ไม่เก็บไฟล์ ไม่สร้าง handle) ใช้ระหว่างเลื่อน slider แล้วส่งแบบปกติตอนกดตกลง
+        """
+        try:
+            # preview ใช้ภาพ proxy ที่เก็บไว้ (โหลดภาพต้นทางเฉพาะตอนสร้าง proxy ครั้งแรก)
+            if preview:
+                result, content = await run_sharpen_preview(get_record(handle), sharpness)
+                return image_response(result, result["extension"], content, PREVIEW_HEADERS)
+
+            # หาภาพต้นทางจาก handle (O(1) และไม่ปนกับภาพของผู้ใช้อื่น)
+            record, source = await get_source_image(handle)
+
+            # key ต่อจาก key ของขั้นตอนก่อนหน้า (ใช้ preset ที่ resolve แล้ว ไม่ใช่ auto)
+            # รวม engine ของ sharpen ด้วย (opencv / pillow ให้ pixel ต่างกันเล็กน้อย)
+            cache = get_result_cache()
+            encoder = resolve_preset(preset, source.width * source.height, image_format(record.extension))
+            cache_key = make_cache_key(record.key, "sharpen", sharpness=sharpness, quality=quality, preset=encoder, engine=SHARPEN_ENGINE)
+            result = await cache.get(cache_key)
+            processed = content = None
+            if result is None:
+                result, processed = await run_image_task(process_sharpen, source, record.filename, record.extension, sharpness, cache_key, encode, return_image, quality, encoder)
+                content = result.pop("content")
+                if result["filename"]:
+                    await cache.put(cache_key, result["filename"], result)
+
+            result["handle"] = image_handles.create(cache_key, result["filename"], result["extension"], processed)
+            if return_image and (content is not None or result["filename"]):
+                return image_response(result, result["extension"], content)
+            return JSONResponse(result)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(500, f"การปรับความคมชัดภาพล้มเหลว: {str(e)}")
+
+    @router.post("/enhance_image")
+    async def enhance_image(
+        handle: str = Form(...),  # handle ที่ได้จาก resize หรือ sharpen
+        noise_reduction: float = Form(0.0, ge=0.0, le=10.0, description="ความแรงของการลด noise (0.0-10.0) - 0=ไม่ลด noise, 1-3=ลดน้อย, 3-5=ลดปานกลาง, 5-10=ลดมาก"),
+        encode: bool = Form(True),  # False = ขั้นตอนกลาง ไม่ต้อง encode เป็นไฟล์
+        return_image: bool = Form(False),  # True = ส่งไฟล์ภาพกลับใน response เลย
+        quality: int = Form(85, ge=1, le=100),
+        preset: str = Form("balanced"),  # fast / balanced / max-compression / auto
+        algorithm: str = Form("auto"),  # auto / median / bilateral / guided / nlmeans
+        preview: bool = Form(False)  # True = ทำบนภาพย่อขนาดจอ ส่งภาพกลับเลย (สำหรับ slider)
+    ):
+        """
+        ปรับปรุงภาพโดยรวม: ลด noise และทำให้ภาพเรียบเนียน
+        - วัด noise จากภาพก่อน แล้วเลือกวิธีที่ถูกที่สุดที่ลดได้ตามความแรงที่ขอ (algorithm=auto)
+          median สำหรับ noise แบบจุด, bilateral / guided filter / fast NL-means สำหรับ noise แบบ Gaussian
+          (auto เลือก NL-means เฉพาะภาพไม่เกิน IMAGE_NLMEANS_MAX_MEGAPIXELS=1 ใช้เวลาราว 1 วินาทีต่อล้าน pixel)
+        - ใช้ค่าที่ผู้ใช้ระบุใน noise_reduction เพื่อกำหนดความแรงของการลด noise (0 = ไม่ลด)
+        - เวลาที่ใช้วัด noise และลด noise อยู่ใน denoise.timings_ms
+        - รองรับภาพโปร่งใส (RGBA)
+        - เหมาะสำหรับทั้งภาพปกติและภาพที่มี noise แบบ salt-and-pepper
+        - encode=false: เก็บผลไว้ใน RAM อย่างเดียว แล้วส่ง handle ต่อให้ขั้นตอนถัดไป
+        - return_image=true: ส่งไฟล์ภาพกลับใน body (metadata อยู่ใน header X-Image-*)
+        - preview=true: ลด noise บนภาพ proxy ขนาดจอ (เลือกวิธีจาก noise ของภาพเต็ม) ส่งภาพกลับใน body เสมอ
+        """
+        try:
+            if preview:
+                result, content = await run_enhance_preview(get_record(handle), noise_reduction, algorithm)
+                return image_response(result, result["extension"], content, PREVIEW_HEADERS)
+
+            record, source = await get_source_image(handle)
+
+            cache = get_result_cache()
+            encoder = resolve_preset(preset, source.width * source.height, image_format(record.extension))
+            cache_key = make_cache_key(record.key, "enhance", noise_reduction=noise_reduction, quality=quality, preset=encoder, algorithm=algorithm.lower())
+            result = await cache.get(cache_key)
+            processed = content = None
+            if result is None:
+                result, processed = await run_image_task(process_enhance, source, record.extension, noise_reduction, cache_key, encode, return_image, quality, encoder, algorithm.lower())
+                content = result.pop("content")
+                if result["filename"]:
+                    await cache.put(cache_key, result["filename"], result)
+
+            result["handle"] = image_handles.create(cache_key, result["filename"], result["extension"], processed)
+            if return_image and (content is not None or result["filename"]):
+                return image_response(result, result["extension"], content)
+            return JSONResponse(result)
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(500, f"การปรับปรุงภาพล้มเหลว: {str(e)}")
+
+    return router
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import Request
+from PIL import Image
+
+from .buffers import ImageData, open_image
+from .executor import run_image_task
+from .formats import AVIF_SUPPORTED
+
+# Config
+AUTO_FORMAT = "auto"
+# วิเคราะห์ภาพจาก thumbnail ขนาดนี้ (ไม่ต้อง decode เต็มภาพสำหรับ JPEG)
+ANALYSIS_SIZE = (128, 128)
+# จำนวนสีไม่เกินนี้ถือเป็นภาพสีเรียบ (กราฟิก / โลโก้ / screenshot) ใช้ PNG แบบ lossless
+FLAT_COLOR_LIMIT = 256
+MAX_ANALYSIS_ENTRIES = 1024
+
+_analysis = OrderedDict()  # sha256 ของไฟล์ -> (has_alpha, is_flat)
+_analysis_lock = threading.Lock()
+
+
+def accepted_types(accept: Optional[str]) -> set:
+    """media type ใน Accept header ที่ q > 0 (ไม่ถือว่า */* รองรับ AVIF / WebP)"""
+    types = set()
+    for part in (accept or "").split(","):
+        fields = [field.strip() for field in part.split(";")]
+        quality = 1.0
+        for field in fields[1:]:
+            if field.startswith("q="):
+                try:
+                    quality = float(field[2:])
+                except ValueError:
+                    quality = 0.0
+        if fields[0] and quality > 0:
+            types.add(fields[0].lower())
+    return types
+
+
+def analyze_image(contents: ImageData) -> Tuple[bool, bool]:
+    """ตรวจว่าภาพมีพื้นที่โปร่งใสจริงหรือไม่ และเป็นภาพสีเรียบหรือภาพถ่าย คืนค่า (has_alpha, is_flat)"""
+    image = open_image(contents)
+    # NEAREST: ไม่สร้างสีใหม่จากการเฉลี่ย (นับจำนวนสีได้ตรงกับต้นฉบับ)
+    image.thumbnail(ANALYSIS_SIZE, Image.NEAREST)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    if has_alpha:
+        has_alpha = image.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    is_flat = image.convert('RGB').getcolors(FLAT_COLOR_LIMIT) is not None
+    return has_alpha, is_flat
+
+
+async def negotiate_format(request: Request, contents: ImageData, content_type: str, digest: str) -> str:
+    """
+    เลือกนามสกุลผลลัพธ์สำหรับ target_format=auto จาก Accept header และเนื้อหาภาพ
+    (digest: result_cache.content_digest ของไฟล์ ใช้จำผลการวิเคราะห์)
+    - ภาพสีเรียบ: png (lossless ขอบคม)
+    - ภาพถ่าย: avif > webp ตามที่ client รับได้ ไม่งั้น jpg (หรือ png ถ้ามี alpha)
+    """
+    accepted = accepted_types(request.headers.get("accept"))
+
+    if content_type == "image/jpeg":
+        has_alpha, is_flat = False, False  # JPEG เป็นภาพถ่ายไม่มี alpha เสมอ ไม่ต้อง decode
+    else:
+        with _analysis_lock:
+            cached = _analysis.get(digest)
+        if cached is None:
+            cached = await run_image_task(analyze_image, contents)
+            with _analysis_lock:
+                _analysis[digest] = cached
+                while len(_analysis) > MAX_ANALYSIS_ENTRIES:
+                    _analysis.popitem(last=False)
+        has_alpha, is_flat = cached
+
+    if is_flat:
+        return "png"
+    if AVIF_SUPPORTED and "image/avif" in accepted:
+        return "avif"
+    if "image/webp" in accepted:
+        return "webp"
+    return "png" if has_alpha else "jpg"
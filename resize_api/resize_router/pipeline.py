@@ -0,0 +1,180 @@
+import json
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from .executor import run_image_task
+from .pixel_pool import SHARPEN_ENGINE, run_pixel_stage, resize_pixels, sharpen_pixels, calculate_sharpness_params
+from .denoise import AUTO_ALGORITHM, DENOISE_ALGORITHMS, denoise_image
+from .decode import apply_jpeg_draft
+from .buffers import ImageData, open_image
+from .result_cache import get_result_cache, content_digest, make_cache_key, cache_url
+from .handles import image_handles
+from .ingest import probe_dimensions
+from .encoders import resolve_preset
+from .formats import OUTPUT_FORMATS
+from .negotiate import AUTO_FORMAT, negotiate_format
+from .engine import RESAMPLING_METHODS, ALLOWED_CONTENT_TYPES, validate_image_file, prepare_output, save_output, image_response
+
+router = APIRouter()
+
+# Config
+MAX_OPERATIONS = 16
+
+
+def parse_operations(raw: str) -> list:
+    """
+    ตรวจสอบและแปลงรายการขั้นตอน (JSON array) ให้อยู่ในรูปมาตรฐาน
+    - {"op": "resize", "width": 800, "height": 600, "method": "bicubic"}
+    - {"op": "sharpen", "sharpness": 1.0}            (-2 ถึง 2)
+    - {"op": "denoise", "noise_reduction": 3.0, "algorithm": "auto"}  (0 ถึง 10, เลือกวิธีแบบ enhance_image)
+    """
+    try:
+        operations = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise HTTPException(400, f"operations ต้องเป็น JSON array: {str(e)}")
+
+    if not isinstance(operations, list) or not operations:
+        raise HTTPException(400, "operations ต้องเป็น JSON array ที่มีอย่างน้อย 1 ขั้นตอน")
+    if len(operations) > MAX_OPERATIONS:
+        raise HTTPException(400, f"ทำได้สูงสุด {MAX_OPERATIONS} ขั้นตอนต่อคำขอ")
+
+    normalized = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise HTTPException(400, f"ขั้นตอนที่ {index + 1} ต้องเป็น object")
+        name = operation.get("op")
+        try:
+            if name == "resize":
+                method = operation.get("method", "bicubic")
+                if method not in RESAMPLING_METHODS:
+                    raise HTTPException(400, f"ขั้นตอนที่ {index + 1}: method ต้องเป็นหนึ่งใน {list(RESAMPLING_METHODS)}")
+                width, height = int(operation["width"]), int(operation["height"])
+                if width <= 0 or height <= 0:
+                    raise ValueError("width/height ต้องมากกว่า 0")
+                normalized.append({"op": "resize", "width": width, "height": height, "method": method})
+            elif name == "sharpen":
+                sharpness = float(operation.get("sharpness", 0.0))
+                if not -2.0 <= sharpness <= 2.0:
+                    raise ValueError("sharpness ต้องอยู่ระหว่าง -2 ถึง 2")
+                normalized.append({"op": "sharpen", "sharpness": sharpness})
+            elif name in ("denoise", "enhance"):
+                noise_reduction = float(operation.get("noise_reduction", 0.0))
+                if not 0.0 <= noise_reduction <= 10.0:
+                    raise ValueError("noise_reduction ต้องอยู่ระหว่าง 0 ถึง 10")
+                algorithm = str(operation.get("algorithm", AUTO_ALGORITHM)).lower()
+                if algorithm != AUTO_ALGORITHM and algorithm not in DENOISE_ALGORITHMS:
+                    raise ValueError(f"algorithm ต้องเป็นหนึ่งใน {[AUTO_ALGORITHM, *DENOISE_ALGORITHMS]}")
+                normalized.append({"op": "denoise", "noise_reduction": noise_reduction, "algorithm": algorithm})
+            else:
+                raise HTTPException(400, f"ขั้นตอนที่ {index + 1}: ไม่รู้จัก op '{name}' (resize, sharpen, denoise)")
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(400, f"ขั้นตอนที่ {index + 1} ({name}) ไม่ถูกต้อง: {str(e)}")
+    return normalized
+
+
+def apply_operation(image: Image.Image, operation: dict) -> Tuple[Image.Image, Optional[dict]]:
+    """ทำหนึ่งขั้นตอนบนภาพที่ decode แล้ว (ไม่มีการ encode ระหว่างทาง) คืนค่า (ภาพ, ข้อมูลของขั้นตอน denoise)"""
+    if operation["op"] == "resize":
+        size = (operation["width"], operation["height"])
+        return run_pixel_stage(resize_pixels, image, size, RESAMPLING_METHODS[operation["method"]]), None
+    if operation["op"] == "sharpen":
+        params = calculate_sharpness_params(operation["sharpness"])
+        return run_pixel_stage(sharpen_pixels, image, params, operation["sharpness"]), None
+    return denoise_image(image, operation["noise_reduction"], operation["algorithm"])
+
+
+def process_pipeline(contents: ImageData, content_type: str, operations: list, extension: str, quality: int, cache_key: str, inline: bool = False, preset: str = "balanced"):
+    """งาน CPU ของ run_pipeline: decode ครั้งเดียว → ทำทุกขั้นตอนบน buffer เดียว → encode ครั้งเดียว"""
+    try:
+        image = open_image(contents)
+        # ถ้าขั้นตอนแรกเป็น resize ให้ JPEG decode ที่ scale เล็กลงได้เลย
+        if operations[0]["op"] == "resize":
+            apply_jpeg_draft(image, (operations[0]["width"], operations[0]["height"]))
+        image.load()
+    except Exception as e:
+        raise HTTPException(400, f"ไม่สามารถเปิดไฟล์ภาพได้: {str(e)}")
+
+    if image.mode == 'P':
+        image = image.convert('RGBA')  # ป้องกัน palette-based
+
+    denoise = []
+    for operation in operations:
+        image, info = apply_operation(image, operation)
+        if info is not None:
+            denoise.append(info)
+
+    output, save_params = prepare_output(image, extension, quality, preset)
+    filename, content = save_output(output, "pipeline", cache_key, extension, inline, **save_params)
+
+    return {
+        "filename": filename,
+        "url": cache_url(filename) if filename else None,
+        "format": extension,
+        "width": output.width,
+        "height": output.height,
+        "operations": operations,
+        "denoise": denoise,  # วิธี / ค่า noise ที่วัดได้ / เวลา ของแต่ละขั้นตอน denoise
+        "preset": preset,
+        "content": content,
+    }, image
+
+
+@router.post("/pipeline")
+async def run_pipeline(
+    request: Request,
+    file: UploadFile = File(...),
+    operations: str = Form(..., description='JSON array ของขั้นตอน เช่น [{"op": "resize", "width": 800, "height": 600, "method": "bicubic"}, {"op": "sharpen", "sharpness": 1}, {"op": "denoise", "noise_reduction": 3}]'),
+    target_format: Optional[str] = Form(None),  # auto = เลือกจาก Accept header และเนื้อหาภาพ
+    quality: int = Form(85, ge=1, le=100),
+    return_image: bool = Form(False),
+    preset: str = Form("balanced")  # fast / balanced / max-compression / auto
+):
+    """
+    ทำ resize + sharpen + denoise + encode ในคำขอเดียว
+    - decode ภาพครั้งเดียว ทำทุกขั้นตอนตามลำดับบน buffer เดียวกัน แล้ว encode ครั้งเดียว
+    - ไม่มีไฟล์ระหว่างทางใน static และ client ไม่ต้องส่งหลายรอบ
+    - คืน handle สำหรับใช้กับ sharpen / enhance_image ต่อได้
+    - return_image=true: ส่งไฟล์ภาพกลับใน body (metadata อยู่ใน header X-Image-*)
+    """
+    try:
+        steps = parse_operations(operations)
+
+        contents, content_type = await validate_image_file(file)
+        digest = await content_digest(contents)
+
+        negotiated = bool(target_format) and target_format.lower() == AUTO_FORMAT
+        if negotiated:
+            extension = await negotiate_format(request, contents, content_type, digest)
+        else:
+            extension = target_format.lower() if target_format else ALLOWED_CONTENT_TYPES.get(content_type, 'webp')
+        vary = {"Vary": "Accept"} if negotiated else None
+        if extension not in OUTPUT_FORMATS:
+            raise HTTPException(400, "รูปแบบไฟล์ปลายทางไม่รองรับ")
+
+        # ขนาดผลลัพธ์ = resize ขั้นสุดท้าย (ไม่มี resize = ขนาดต้นฉบับ) ใช้เลือก preset แบบ auto
+        # key ใช้ preset ที่ resolve แล้ว (auto ได้ผลต่างกันตามคิวงาน) และ engine ของ sharpen
+        resizes = [step for step in steps if step["op"] == "resize"]
+        size = (resizes[-1]["width"], resizes[-1]["height"]) if resizes else probe_dimensions(contents) or (0, 0)
+        encoder = resolve_preset(preset, size[0] * size[1], OUTPUT_FORMATS[extension])
+        cache = get_result_cache()
+        cache_key = make_cache_key(digest, "pipeline", operations=steps, extension=extension, quality=quality, preset=encoder, sharpen_engine=SHARPEN_ENGINE)
+        result = await cache.get(cache_key)
+        image = content = None
+        if result is None:
+            result, image = await run_image_task(process_pipeline, contents, content_type, steps, extension, quality, cache_key, return_image, encoder)
+            content = result.pop("content")
+            if result["filename"]:
+                await cache.put(cache_key, result["filename"], result)
+
+        result["handle"] = image_handles.create(cache_key, result["filename"], extension, image)
+        if return_image:
+            return image_response(result, extension, content, vary)
+        return JSONResponse(result, headers=vary)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"การประมวลผล pipeline ล้มเหลว: {str(e)}")
@@ -0,0 +1,338 @@
+import math
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFilter
+
+# Config
+# IMAGE_PIXEL_BACKEND: "inline" (ค่าเริ่มต้น ทำใน process เดิม) หรือ "process"
+# แบบ process จะส่ง pixel ผ่าน shared memory ไปให้ worker แทนการ pickle
+PIXEL_BACKEND = os.getenv("IMAGE_PIXEL_BACKEND", "inline").lower()
+PIXEL_WORKERS = int(os.getenv("IMAGE_PIXEL_WORKERS", str(os.cpu_count() or 2)))
+
+# resize แบบลดขนาดหลายเท่า: ย่อด้วย reduce() (box) ก่อนแล้วค่อย resample ที่เหลือ
+REDUCING_GAP = float(os.getenv("IMAGE_REDUCING_GAP", "3.0"))
+
+# โหมดสีที่ส่งผ่าน shared memory ได้ (uint8 ทั้งหมด)
+SHM_MODES = ('L', 'RGB', 'RGBA')
+
+# IMAGE_SHARPEN_ENGINE: "opencv" (ค่าเริ่มต้น blur / unsharp mask บน array เดียว alpha อยู่ใน array)
+# หรือ "pillow" (ImageFilter แบบเดิม แยก alpha แล้วประกอบกลับ)
+SHARPEN_ENGINE = os.getenv("IMAGE_SHARPEN_ENGINE", "opencv").lower()
+# โหมดสีที่ engine opencv ทำได้ (uint8 1-4 ช่อง) โหมดอื่นใช้ Pillow
+ARRAY_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# ภาพที่ใหญ่กว่านี้ทำ filter ทีละ tile (มีขอบซ้อนกัน) แทนการทำทั้งภาพ
+# หน่วยความจำชั่วคราวของ filter จะจำกัดตามขนาด tile ไม่ขึ้นกับความละเอียดของภาพ
+TILE_MIN_PIXELS = int(float(os.getenv("IMAGE_TILE_MIN_MEGAPIXELS", "16")) * 1_000_000)
+TILE_SIZE = int(os.getenv("IMAGE_TILE_SIZE", "1024"))
+TILE_WORKERS = int(os.getenv("IMAGE_TILE_WORKERS", str(os.cpu_count() or 2)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_tile_pool: Optional[ThreadPoolExecutor] = None
+# True ใน worker process ของ pool (ตั้งโดย mark_pool_worker ตอน worker เริ่ม)
+_in_pool_worker = False
+
+
+def mark_pool_worker():
+    """
+    initializer ของ ProcessPoolExecutor ทุกตัว (pixel pool และ IMAGE_EXECUTOR=process)
+    ไม่ใช้ multiprocessing.parent_process() เพราะ uvicorn --reload / --workers รัน app ใน child process อยู่แล้ว
+    """
+    global _in_pool_worker
+    _in_pool_worker = True
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PIXEL_WORKERS, initializer=mark_pool_worker)
+    return _pool
+
+
+def _use_process_pool(image: Image.Image) -> bool:
+    # ถ้าเราอยู่ใน worker process อยู่แล้ว (IMAGE_EXECUTOR=process) ให้ทำในที่เลย ไม่ซ้อน pool
+    return (
+        PIXEL_BACKEND == "process"
+        and not _in_pool_worker
+        and image.mode in SHM_MODES
+    )
+
+
+def _export(array: np.ndarray) -> Tuple[str, tuple]:
+    """คัดลอก array ลง shared memory block ใหม่ แล้วคืน (ชื่อ block, shape)"""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    try:
+        np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf)[...] = array
+    finally:
+        shm.close()
+    return shm.name, array.shape
+
+
+def _import(descriptor: Tuple[str, tuple], unlink: bool) -> Image.Image:
+    """อ่านภาพจาก shared memory block (คัดลอกออกมา) แล้วปิด block"""
+    name, shape = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        image = Image.fromarray(view.copy())
+        del view
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return image
+
+
+def _shm_worker(func, descriptor: Tuple[str, tuple], args: tuple) -> Tuple[str, tuple]:
+    """ฝั่ง worker: แนบ shared memory ของต้นทาง ประมวลผล แล้วเขียนผลลง block ใหม่"""
+    name, shape = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        view = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        result = func(Image.fromarray(view), *args)
+        if result.mode not in SHM_MODES:
+            result = result.convert('RGBA' if 'A' in result.getbands() else 'RGB')
+        out = _export(np.asarray(result))
+        # ต้องปล่อย reference ที่ชี้ไปยัง buffer ก่อน close
+        del result, view
+    finally:
+        shm.close()
+    return out
+
+
+def run_pixel_stage(func, image: Image.Image, *args) -> Image.Image:
+    """
+    รันขั้นตอนประมวลผล pixel (resize / sharpen / median) บน backend ที่ตั้งไว้
+    - func รับ Image และคืน Image ต้องเป็นฟังก์ชันระดับ module
+    - backend "process": ส่ง pixel ผ่าน multiprocessing.shared_memory ทั้งขาไปและขากลับ
+    """
+    if not _use_process_pool(image):
+        return func(image, *args)
+
+    source = _export(np.asarray(image))
+    try:
+        result = _get_pool().submit(_shm_worker, func, source, args).result()
+    finally:
+        _unlink(source[0])
+    return _import(result, unlink=True)
+
+
+def _unlink(name: str):
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+
+def shutdown_pixel_pool():
+    global _pool, _tile_pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+    if _tile_pool is not None:
+        _tile_pool.shutdown(wait=True, cancel_futures=True)
+        _tile_pool = None
+
+
+# ---------- ประมวลผลแบบ tile ----------
+
+def _get_tile_pool() -> ThreadPoolExecutor:
+    # thread พอ: Pillow filter และ OpenCV ปล่อย GIL ระหว่างคำนวณ
+    global _tile_pool
+    if _tile_pool is None:
+        _tile_pool = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="tile")
+    return _tile_pool
+
+
+def should_tile(image: Image.Image) -> bool:
+    return TILE_SIZE > 0 and image.width * image.height >= TILE_MIN_PIXELS
+
+
+def tile_boxes(size: Tuple[int, int], tile_size: int):
+    """กล่องของแต่ละ tile (left, top, right, bottom) เรียงเป็นแถวจากบนลงล่าง"""
+    width, height = size
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            yield left, top, min(left + tile_size, width), min(top + tile_size, height)
+
+
+def _process_tile(func, image: Image.Image, box: Tuple[int, int, int, int], halo: int, args: tuple) -> Image.Image:
+    """ตัด tile พร้อมขอบ halo รอบด้าน (ไม่เกินขอบภาพ) ประมวลผล แล้วตัดขอบออกให้เหลือเฉพาะ tile"""
+    left, top, right, bottom = box
+    outer = (max(0, left - halo), max(0, top - halo), min(image.width, right + halo), min(image.height, bottom + halo))
+    processed = func(image.crop(outer), *args)
+    return processed.crop((left - outer[0], top - outer[1], right - outer[0], bottom - outer[1]))
+
+
+def run_tiled(func, image: Image.Image, halo: int, *args) -> Image.Image:
+    """
+    รัน filter แบบ tile: แต่ละ tile ได้ pixel รอบข้างเพิ่ม halo pixel (เท่ารัศมีของ kernel)
+    ทุก pixel ได้ข้อมูลรอบข้างครบเท่าการ filter ทั้งภาพ แต่ array ชั่วคราวมีขนาดแค่ tile
+    (filter ของ OpenCV เลือกเส้นทาง SIMD ตามความกว้างของ array ผลอาจปัดต่างจากทั้งภาพได้ 1 ระดับ
+    เช่น bilateral บนภาพ L ดู benchmarks/denoise_tiling.py)
+    - tile ทำพร้อมกันบน thread pool ค้างอยู่ไม่เกิน 2 เท่าของจำนวน worker
+    - วางผลแต่ละ tile ลงภาพผลลัพธ์ที่จองไว้ครั้งเดียว
+    """
+    pool = _get_tile_pool()
+    window = max(1, TILE_WORKERS * 2)
+    output = None
+    pending = deque()
+
+    def paste(future, box):
+        nonlocal output
+        tile = future.result()
+        if output is None:
+            output = Image.new(tile.mode, image.size)
+        output.paste(tile, box[:2])
+
+    for box in tile_boxes(image.size, TILE_SIZE):
+        pending.append((pool.submit(_process_tile, func, image, box, halo, args), box))
+        if len(pending) >= window:
+            paste(*pending.popleft())
+    while pending:
+        paste(*pending.popleft())
+    return output
+
+
+# ---------- พารามิเตอร์ของ filter ----------
+
+def calculate_sharpness_params(sharpness: float):
+    """คำนวณค่า radius, percent, threshold จากค่า sharpness (-2 ถึง 2)"""
+    if sharpness == 0:
+        # ไม่ทำการปรับเปลี่ยนภาพ (no operation)
+        return {
+            'use_blur': False,
+            'radius': 0,  # ไม่มี radius เมื่อไม่ประมวลผล
+            'percent': 0,  # 0% = ไม่เปลี่ยนค่า
+            'threshold': 0  # ไม่มี threshold
+        }
+    elif sharpness < 0:
+        # Gaussian Blur เมื่อต้องการลดความคมชัด
+        radius = abs(sharpness) * 2  # 0 ถึง 4
+        return {
+            'use_blur': True,
+            'radius': radius,
+            'percent': 0,
+            'threshold': 0
+        }
+    else:
+        # Unsharp Mask เมื่อต้องการเพิ่มความคมชัด
+        radius = 1.0 + (sharpness * 0.5)  # ปรับให้ radius เริ่มที่ 1.0 แทน 2.0 (เพื่อความ natural)
+        percent = 100 + int(sharpness * 50)  # 100% ถึง 200% (ลดความแรงจากเดิม)
+        threshold = max(0, 3 - int(sharpness * 1.5))  # 3 ถึง 0 (ปรับเกณฑ์ให้ละเอียดขึ้น)
+        return {
+            'use_blur': False,
+            'radius': radius,
+            'percent': percent,
+            'threshold': threshold
+        }
+
+
+def calculate_median_kernel(noise_reduction: float) -> int:
+    """คำนวณ kernel size ของ median filter จาก noise_reduction (0-10) ได้เลขคี่ 3 ถึง 11"""
+    base_size = int(noise_reduction * 2)
+    return max(3, min(11, base_size if base_size % 2 != 0 else base_size + 1))
+
+
+# ---------- ขั้นตอนประมวลผล (Image -> Image) ----------
+
+def resize_pixels(image: Image.Image, size: Tuple[int, int], resample: int) -> Image.Image:
+    # NEAREST ต้องคงลักษณะ pixel เดิม จึงไม่ใช้ reducing_gap (ซึ่งเฉลี่ยแบบ box)
+    if resample == Image.NEAREST or REDUCING_GAP <= 0:
+        return image.resize(size, resample)
+    return image.resize(size, resample, reducing_gap=REDUCING_GAP)
+
+
+def filter_halo(radius: float) -> int:
+    """ขอบที่ tile ต้องมีสำหรับ GaussianBlur / UnsharpMask ของ Pillow (box blur 3 รอบ ยาวราว 3 เท่าของ radius)"""
+    return math.ceil(radius * 3) + 1
+
+
+def array_filter_halo(radius: float) -> int:
+    """ขอบที่ tile ต้องมีสำหรับ cv2.GaussianBlur (kernel ที่ OpenCV เลือกจาก sigma กว้างราว 4 เท่าของ sigma)"""
+    return math.ceil(radius * 4) + 1
+
+
+def pillow_filter(params: dict) -> ImageFilter.Filter:
+    """ImageFilter ของ Pillow ตามพารามิเตอร์จาก calculate_sharpness_params"""
+    if params['use_blur']:
+        return ImageFilter.GaussianBlur(radius=params['radius'])
+    return ImageFilter.UnsharpMask(
+        radius=params['radius'],
+        percent=params['percent'],
+        threshold=params['threshold']
+    )
+
+
+def sharpen_pixels(image: Image.Image, params: dict, sharpness: float) -> Image.Image:
+    """sharpen หรือ blur ตามพารามิเตอร์จาก calculate_sharpness_params (คง alpha ไว้ ภาพใหญ่ทำทีละ tile)"""
+    if not params['use_blur'] and sharpness <= 0:
+        return image
+
+    if SHARPEN_ENGINE == "opencv" and image.mode in ARRAY_MODES:
+        func, halo, arg = sharpen_array, array_filter_halo(params['radius']), params
+    else:
+        func, halo, arg = filter_pixels, filter_halo(params['radius']), pillow_filter(params)
+    if should_tile(image):
+        return run_tiled(func, image, halo, arg)
+    return func(image, arg)
+
+
+def sharpen_array(image: Image.Image, params: dict) -> Image.Image:
+    """
+    Gaussian blur / unsharp mask ด้วย OpenCV ทุกช่องใน array เดียว แล้วคืน alpha เดิมลงช่องสุดท้าย
+    (ไม่แยกช่อง alpha / แปลง RGB ไปกลับแบบ Pillow)
+    - sigma = radius เหมือน ImageFilter.GaussianBlur ขอบภาพใช้ค่าขอบซ้ำ (BORDER_REPLICATE) เหมือน Pillow
+    - unsharp: ผลลัพธ์ = ภาพ + (ภาพ - blur) * percent / 100 เฉพาะ pixel ที่ต่างจาก blur เกิน threshold
+    """
+    array = np.asarray(image)
+    blurred = cv2.GaussianBlur(array, (0, 0), params['radius'], borderType=cv2.BORDER_REPLICATE)
+    if params['use_blur']:
+        processed = blurred
+    else:
+        amount = params['percent'] / 100
+        keep = None
+        if params['threshold'] > 0:
+            # pixel ที่ต่างจาก blur ไม่เกิน threshold คงค่าเดิม (mask 0/1 เขียนทับ buffer ของ absdiff)
+            keep = cv2.absdiff(array, blurred)
+            np.less_equal(keep, params['threshold'], out=keep.view(np.bool_))
+        # saturate เป็น uint8 ในตัว และเขียนผลทับ buffer ของ blur (ไม่จอง array เพิ่ม)
+        processed = cv2.addWeighted(array, 1 + amount, blurred, -amount, 0, dst=blurred)
+        if keep is not None:
+            cv2.copyTo(array, keep, processed)
+    if image.mode in ('RGBA', 'LA'):
+        processed[..., -1] = array[..., -1]
+    return Image.fromarray(processed)
+
+
+def filter_pixels(image: Image.Image, image_filter: ImageFilter.Filter) -> Image.Image:
+    """ใช้ filter ของ Pillow กับช่องสี โดยคง alpha เดิม"""
+    if image.mode in ('RGBA', 'LA'):
+        # แยก alpha ไว้ แล้ว filter เฉพาะช่องสี
+        alpha = image.getchannel('A')
+        processed = image.convert('RGB').filter(image_filter).convert('RGBA')
+        processed.putalpha(alpha)
+        return processed
+    return image.filter(image_filter)
+
+
+def median_pixels(image: Image.Image, kernel_size: int) -> Image.Image:
+    """median filter ด้วย OpenCV บน array เดียว (alpha คงเดิม ไม่ต้องแยก/ประกอบช่องใหม่) ภาพใหญ่ทำทีละ tile"""
+    if image.mode == 'LA':
+        image = image.convert('RGBA')
+    if should_tile(image):
+        return run_tiled(median_array, image, kernel_size // 2, kernel_size)
+    return median_array(image, kernel_size)
+
+
+def median_array(image: Image.Image, kernel_size: int) -> Image.Image:
+    array = np.asarray(image)
+    processed = cv2.medianBlur(array, kernel_size)
+    if image.mode == 'RGBA':
+        processed[..., 3] = array[..., 3]
+    return Image.fromarray(processed)
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from PIL import Image
+
+from .buffers import ImageData, encode_image
+from .denoise import AUTO_ALGORITHM, DENOISE_ALGORITHMS, estimate_noise, plan_denoise, denoise_pixels
+from .encoders import encoder_params
+from .executor import run_image_task
+from .handles import ImageRecord, decoded_images
+from .engine import load_source_image
+from .pixel_pool import resize_pixels, sharpen_pixels, calculate_sharpness_params
+
+# Config
+# ด้านยาวสุดของภาพ proxy สำหรับ preview (ประมาณขนาดจอ) ภาพที่เล็กกว่านี้ใช้ภาพเดิม
+PREVIEW_MAX_SIZE = int(os.getenv("IMAGE_PREVIEW_MAX_SIZE", "1280"))
+PREVIEW_QUALITY = int(os.getenv("IMAGE_PREVIEW_QUALITY", "75"))
+# preview เน้นความเร็ว: JPEG (หรือ WebP ถ้ามี alpha) ด้วย preset ที่เร็วที่สุด
+PREVIEW_PRESET = "fast"
+# ผล preview เปลี่ยนทุก tick ของ slider ไม่ต้องเก็บไว้ที่ browser / CDN
+PREVIEW_HEADERS = {"Cache-Control": "no-store"}
+# วิธีที่ช้าเกินไปสำหรับ slider (NL-means หลายร้อย ms แม้บนภาพ proxy) ใช้วิธีที่ใกล้เคียงแทนใน preview
+PREVIEW_SUBSTITUTES = {"nlmeans": "guided"}
+# จำนวนผลการวัด noise ที่เก็บไว้ (ภาพเต็มใช้เลือกวิธีให้ตรงกับตอน commit, proxy ใช้กำหนดความแรง)
+MAX_NOISE_ENTRIES = 512
+
+_noise = OrderedDict()  # key ของภาพ (ต้นทางหรือ proxy) -> (sigma, impulse_ratio)
+_noise_lock = threading.Lock()
+
+
+def proxy_key(key: str) -> str:
+    """key ของภาพ proxy ใน decoded_images (ต่อจาก key ของภาพต้นทาง)"""
+    return f"{key}:preview{PREVIEW_MAX_SIZE}"
+
+
+def make_proxy(image: Image.Image) -> Image.Image:
+    """ย่อภาพให้ด้านยาวไม่เกิน PREVIEW_MAX_SIZE (ทำครั้งเดียวต่อภาพต้นทาง)"""
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+    scale = PREVIEW_MAX_SIZE / max(image.size)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return resize_pixels(image, size, Image.LANCZOS)
+
+
+async def get_proxy(record: ImageRecord) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    ภาพ proxy ของ handle นี้ และขนาดของภาพต้นทาง สร้างครั้งแรกแล้วเก็บไว้ใน decoded_images
+    ทุก tick ของ slider ใช้ภาพเดิม (โหลด / decode ภาพต้นทางเฉพาะตอนที่ยังไม่มี proxy)
+    """
+    key = proxy_key(record.key)
+    proxy = decoded_images.get(key)
+    if proxy is None:
+        source = await load_source_image(record)
+        proxy = await run_image_task(make_proxy, source)
+        proxy.info["source_size"] = source.size
+        decoded_images.put(key, proxy)
+    return proxy, proxy.info.get("source_size", proxy.size)
+
+
+def cached_noise(key: str) -> Optional[Tuple[float, float]]:
+    """noise ที่เคยวัดไว้แล้ว (None ถ้ายังไม่เคยวัด)"""
+    with _noise_lock:
+        noise = _noise.get(key)
+        if noise is not None:
+            _noise.move_to_end(key)
+        return noise
+
+
+async def get_noise(key: str, image: Image.Image) -> Tuple[float, float]:
+    """noise ที่วัดได้ของภาพต้นทางหรือภาพ proxy (วัดครั้งเดียวต่อภาพ ไม่ต้องวัดใหม่ทุก tick)"""
+    noise = cached_noise(key)
+    if noise is not None:
+        return noise
+    noise = await run_image_task(estimate_noise, image)
+    with _noise_lock:
+        _noise[key] = noise
+        while len(_noise) > MAX_NOISE_ENTRIES:
+            _noise.popitem(last=False)
+    return noise
+
+
+def encode_preview(image: Image.Image, quality: int = PREVIEW_QUALITY) -> Tuple[ImageData, str]:
+    """encode แบบเร็ว คืนค่า (bytes, นามสกุล) ภาพที่มี alpha ใช้ WebP นอกนั้นใช้ JPEG"""
+    if image.mode in ('RGBA', 'LA'):
+        extension, output_format = "webp", "WEBP"
+    else:
+        extension, output_format = "jpg", "JPEG"
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    return encode_image(image, output_format, **encoder_params(output_format, PREVIEW_PRESET, quality)), extension
+
+
+def preview_result(proxy: Image.Image, processed: Image.Image, source_size: Tuple[int, int], started: float, **fields) -> Tuple[dict, ImageData]:
+    """encode ผลของ preview แล้วรวม metadata (ขนาด proxy / ภาพต้นทาง และเวลาที่ใช้แต่ละขั้นตอน)"""
+    processed_at = time.perf_counter()
+    content, extension = encode_preview(processed)
+    finished = time.perf_counter()
+    result = {
+        "preview": True,
+        "extension": extension,
+        "source_width": source_size[0],
+        "source_height": source_size[1],
+        "scale": round(proxy.width / source_size[0], 4),
+        **fields,
+        "width": processed.width,
+        "height": processed.height,
+        "timings_ms": {
+            "process": round((processed_at - started) * 1000, 2),
+            "encode": round((finished - processed_at) * 1000, 2),
+        },
+    }
+    return result, content
+
+
+def process_sharpen_preview(proxy: Image.Image, source_size: Tuple[int, int], sharpness: float) -> Tuple[dict, ImageData]:
+    """
+    sharpen / blur บนภาพ proxy (รันใน worker pool ผ่าน run_image_task)
+    radius ย่อตามอัตราส่วนของ proxy ผลที่เห็นบนจอจึงใกล้กับภาพเต็มที่ย่อลงมาแสดง
+    """
+    started = time.perf_counter()
+    scale = proxy.width / source_size[0]
+    params = calculate_sharpness_params(sharpness)
+    params['radius'] = round(params['radius'] * scale, 3)
+    processed = sharpen_pixels(proxy, params, sharpness)
+    return preview_result(proxy, processed, source_size, started, sharpness=sharpness, params=params)
+
+
+def process_enhance_preview(proxy: Image.Image, source_size: Tuple[int, int], noise_reduction: float, algorithm: str, source_noise: Optional[Tuple[float, float]], proxy_noise: Optional[Tuple[float, float]]) -> Tuple[dict, ImageData]:
+    """
+    ลด noise บนภาพ proxy (รันใน worker pool ผ่าน run_image_task)
+    - เลือกวิธีจาก noise ของภาพเต็ม (วิธีเดียวกับตอน commit)
+    - ความแรงคำนวณจาก noise ที่วัดบน proxy (การย่อภาพเฉลี่ย noise ไปบางส่วนแล้ว)
+    - kernel ของ median ย่อตามอัตราส่วนของ proxy
+    - NL-means แสดงผลด้วย guided filter ที่ความแรงเดียวกัน (ดู PREVIEW_SUBSTITUTES)
+    """
+    started = time.perf_counter()
+    if noise_reduction <= 0:
+        return preview_result(proxy, proxy, source_size, started, noise_reduction=noise_reduction, algorithm="none")
+
+    scale = proxy.width / source_size[0]
+    sigma, impulse_ratio = source_noise
+    algorithm = plan_denoise(noise_reduction, algorithm, sigma, impulse_ratio, source_size[0] * source_size[1])["algorithm"]
+    preview_algorithm = PREVIEW_SUBSTITUTES.get(algorithm, algorithm)
+    plan = plan_denoise(noise_reduction, preview_algorithm, *proxy_noise, proxy.width * proxy.height)
+    if preview_algorithm == "median":
+        kernel_size = round(plan["params"]["kernel_size"] * scale)
+        plan["params"]["kernel_size"] = max(3, kernel_size if kernel_size % 2 else kernel_size + 1)
+    processed = denoise_pixels(proxy, preview_algorithm, plan["params"])
+    return preview_result(
+        proxy, processed, source_size, started,
+        noise_reduction=noise_reduction, algorithm=algorithm, preview_algorithm=preview_algorithm,
+        params=plan["params"], target_sigma=plan["target_sigma"],
+    )
+
+
+async def run_sharpen_preview(record: ImageRecord, sharpness: float) -> Tuple[dict, ImageData]:
+    proxy, source_size = await get_proxy(record)
+    return await run_image_task(process_sharpen_preview, proxy, source_size, sharpness)
+
+
+async def run_enhance_preview(record: ImageRecord, noise_reduction: float, algorithm: str = AUTO_ALGORITHM) -> Tuple[dict, ImageData]:
+    algorithm = (algorithm or AUTO_ALGORITHM).lower()
+    if algorithm != AUTO_ALGORITHM and algorithm not in DENOISE_ALGORITHMS:
+        raise HTTPException(400, f"algorithm ต้องเป็นหนึ่งใน {[AUTO_ALGORITHM, *DENOISE_ALGORITHMS]}")
+    proxy, source_size = await get_proxy(record)
+    source_noise = proxy_noise = None
+    if noise_reduction > 0:
+        # noise ของภาพเต็มวัดครั้งเดียว tick ถัดไปไม่ต้องโหลดภาพเต็มอีก
+        source_noise = cached_noise(record.key) or await get_noise(record.key, await load_source_image(record))
+        proxy_noise = await get_noise(proxy_key(record.key), proxy)
+    return await run_image_task(process_enhance_preview, proxy, source_size, noise_reduction, algorithm, source_noise, proxy_noise)
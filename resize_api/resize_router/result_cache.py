@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from .buffers import ImageData
+from .storage import get_storage
+
+# Config
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# ลบผลลัพธ์ที่ไม่มีใครใช้เกินเวลานี้ (นับจากการใช้งานล่าสุด)
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(24 * 3600)))
+# mtime ของไฟล์ใหม่กว่าเวลาที่ใช้ล่าสุดใน process นี้เกินนี้ = process อื่นใช้ไฟล์อยู่ (กันความคลาดเคลื่อนของเวลาใน filesystem)
+TOUCH_SLACK_SECONDS = 1.0
+
+
+async def content_digest(contents: ImageData) -> str:
+    """
+    sha256 ของไฟล์อัปโหลด คำนวณใน thread (ไม่บล็อก event loop) ครั้งเดียวต่อไฟล์
+    ใช้ร่วมกันทั้ง make_cache_key และ memo ของ negotiate_format
+    """
+    return await asyncio.to_thread(lambda: hashlib.sha256(contents).hexdigest())
+
+
+def make_cache_key(source: str, operation: str, **params) -> str:
+    """
+    สร้าง key แบบ content-addressed จาก digest ของไฟล์ต้นฉบับ (content_digest) หรือ key ของขั้นตอนก่อนหน้า + พารามิเตอร์
+    ใช้ key เดียวกัน = ได้ไฟล์ผลลัพธ์เดิมกลับไปโดยไม่ต้อง decode ใหม่
+    """
+    digest = hashlib.sha256()
+    digest.update(source.encode())
+    digest.update(operation.encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def cache_filename(prefix: str, key: str, extension: str) -> str:
+    """ชื่อไฟล์ผลลัพธ์ที่ได้จาก key (ไม่มี timestamp ชื่อเดิมทุกครั้งสำหรับ input เดิม)"""
+    return f"{prefix}_{key[:32]}.{extension}"
+
+
+def cache_url(filename: str) -> str:
+    """URL ของไฟล์ผลลัพธ์ตาม storage ที่ใช้ (local: /static/cache/<shard>/<filename>)"""
+    return get_storage().url(filename)
+
+
+class ResultCache:
+    """
+    cache ผลลัพธ์ resize/convert/sharpen/enhance บน storage (storage.get_storage)
+    - index อยู่ใน memory (OrderedDict เรียงตามการใช้งานล่าสุด) เป็นรายการไฟล์ที่ยังใช้งานอยู่
+    - จำกัดขนาดรวมเป็น byte และอายุตั้งแต่ใช้ล่าสุด (RESULT_CACHE_TTL_SECONDS)
+    - get() / put() เป็น async: การเรียก storage (stat / HEAD ของ S3) รันใน thread ไม่บล็อก event loop
+    - การลบไฟล์ไม่ทำใน request: CacheJanitor (janitor.py) เรียก collect() / release() เป็นรอบ
+    - index อยู่ได้เท่าอายุ process และแยกกันต่อ process (uvicorn --workers N มี N index บน storage เดียวกัน)
+      ทุกครั้งที่ใช้ไฟล์จะ touch mtime เป็นเวลาที่ใช้ล่าสุด process ไหนก็ตามจะไม่ลบไฟล์ที่ process อื่นเพิ่งใช้
+    """
+
+    def __init__(self, storage=None, max_bytes: int = RESULT_CACHE_MAX_BYTES, ttl_seconds: int = RESULT_CACHE_TTL_SECONDS):
+        self.storage = storage or get_storage()
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> {"filename", "size", "accessed", "response"}
+        self._files = {}  # filename -> key ของไฟล์ที่ยังอยู่ใน index (หรือกำลัง put)
+        self._deleting = set()  # ไฟล์ที่ release() กำลังตรวจ / ลบบน storage (ทำนอก lock)
+        self._lock = threading.Lock()
+        self._deleted = threading.Condition(self._lock)
+        # callback ปลุก janitor เมื่อขนาดเกิน quota (ตั้งโดย CacheJanitor.start)
+        self.wake = None
+        self.storage.prepare()
+
+    async def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            accessed = entry["accessed"] = time.time()
+            self._entries.move_to_end(key)
+        if not await asyncio.to_thread(self.storage.touch, entry["filename"], accessed):
+            # ไฟล์หายไปจาก storage (ถูกลบจากภายนอก) ถือว่า miss
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._drop(key)
+            return None
+        # URL สร้างใหม่ทุกครั้ง (presigned URL ของ S3 มีอายุ ใช้ของตอน put ไม่ได้)
+        response = dict(entry["response"])
+        response["url"] = cache_url(entry["filename"])
+        return response
+
+    async def put(self, key: str, filename: str, response: dict):
+        size = await asyncio.to_thread(self._claim, key, filename)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            # ไม่เก็บ url (get สร้างจากชื่อไฟล์ใหม่ทุกครั้ง)
+            self._entries[key] = {"filename": filename, "size": size, "accessed": time.time(), "response": {**response, "url": None}}
+            self._files[filename] = key
+            self.total_bytes += size
+            over_quota = self.total_bytes > self.max_bytes
+        if over_quota and self.wake:
+            self.wake()
+
+    def collect(self, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        เอา entry ที่หมดอายุ และ entry เก่าสุดที่ทำให้เกิน quota ออกจาก index
+        คืน (ชื่อไฟล์, เวลาที่ใช้ล่าสุด) ที่ต้องลบ (ยังไม่ลบ ให้ release() ลบทีหลังนอก lock ของ index)
+        """
+        now = time.time() if now is None else now
+        filenames = []
+        with self._lock:
+            for key in list(self._entries):
+                if now - self._entries[key]["accessed"] <= self.ttl_seconds:
+                    break  # เรียงตามการใช้งานล่าสุด entry ที่เหลือใหม่กว่านี้ทั้งหมด
+                filenames.append(self._drop(key))
+            # เก็บ entry ล่าสุดไว้เสมอ แม้ขนาดจะเกิน (ไม่งั้น client จะได้ URL ที่ไม่มีไฟล์)
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                filenames.append(self._drop(next(iter(self._entries))))
+        return filenames
+
+    def _claim(self, key: str, filename: str) -> int:
+        """
+        จองชื่อไฟล์ก่อน put (release() จะข้ามไฟล์นี้) แล้วคืนขนาดไฟล์ (รันใน thread)
+        ถ้า release() กำลังลบไฟล์ชื่อนี้อยู่ รอให้เสร็จก่อน: ถ้าไฟล์ที่เพิ่งเขียนถูกลบไป size() จะ error แทนการคืน URL ที่ไม่มีไฟล์
+        """
+        with self._lock:
+            while filename in self._deleting:
+                self._deleted.wait()
+            self._files.setdefault(filename, key)
+        try:
+            return self.storage.size(filename)
+        except Exception:
+            with self._lock:
+                if self._files.get(filename) == key and key not in self._entries:
+                    del self._files[filename]
+            raise
+
+    def release(self, files: List[Tuple[str, float]]) -> int:
+        """
+        ลบไฟล์ที่ไม่อยู่ใน index แล้ว คืนจำนวนไฟล์ที่ลบ ข้ามไฟล์ที่
+        - ถูก put กลับเข้ามาใหม่ระหว่างนั้น
+        - มี mtime ใหม่กว่าเวลาที่ใช้ล่าสุดที่รู้ (process อื่นเขียนหรือใช้ไฟล์นี้ทีหลัง)
+        ถือ lock เฉพาะตอนตรวจ index การเรียก storage (HEAD / DELETE ของ S3) ทำนอก lock ไม่ให้ get / put ค้าง
+        """
+        removed = 0
+        for filename, last_used in files:
+            with self._lock:
+                if filename in self._files or filename in self._deleting:
+                    continue  # key เดิมถูกสร้างใหม่ ไฟล์ชื่อเดิมกลับมาใช้งานแล้ว
+                self._deleting.add(filename)
+            try:
+                modified = self.storage.modified(filename)
+                if modified is None or modified > last_used + TOUCH_SLACK_SECONDS:
+                    continue
+                if self.storage.delete(filename):
+                    removed += 1
+            except Exception as e:
+                print(f"Error deleting {filename}: {e}")
+            finally:
+                with self._lock:
+                    self._deleting.discard(filename)
+                    self._deleted.notify_all()
+        return removed
+
+    def is_live(self, filename: str) -> bool:
+        with self._lock:
+            return filename in self._files
+
+    def _drop(self, key: str) -> Tuple[str, float]:
+        entry = self._entries.pop(key)
+        self._files.pop(entry["filename"], None)
+        self.total_bytes -= entry["size"]
+        return entry["filename"], entry["accessed"]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_result_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    """cache ตัวเดียวของ API process (สร้างครั้งแรกที่เรียก worker process จึงไม่ไปล้างไฟล์)"""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
@@ -0,0 +1,265 @@
+import hashlib
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Iterator, Optional, Tuple
+
+from fastapi.responses import FileResponse, RedirectResponse, Response
+from PIL import Image
+
+from .buffers import memory_file
+
+# S3 / MinIO ใช้ boto3 ถ้าติดตั้งไว้
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+# Config
+# IMAGE_STORAGE: "local" (ค่าเริ่มต้น อยู่ใต้ static/ ให้ /static mount ส่งไฟล์) หรือ "s3"
+STORAGE_BACKEND = os.getenv("IMAGE_STORAGE", "local").lower()
+CACHE_DIR = os.path.join("static", "cache")
+CACHE_URL_PREFIX = "/static/cache"
+# แบ่งโฟลเดอร์ตาม hash ในชื่อไฟล์ 2 ชั้น ชั้นละ 2 หลัก (256 x 256 โฟลเดอร์) ไม่ให้ไฟล์กองในโฟลเดอร์เดียว
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+# S3-compatible (AWS S3 / MinIO / R2): IMAGE_S3_ENDPOINT_URL ใช้ชี้ไป MinIO ในเครื่องได้
+S3_BUCKET = os.getenv("IMAGE_S3_BUCKET", "")
+S3_PREFIX = os.getenv("IMAGE_S3_PREFIX", "cache").strip("/")
+S3_ENDPOINT_URL = os.getenv("IMAGE_S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("IMAGE_S3_REGION") or None
+# URL สาธารณะของ bucket (เช่น CDN) ถ้าไม่ตั้งจะใช้ presigned URL
+S3_PUBLIC_URL = os.getenv("IMAGE_S3_PUBLIC_URL", "").rstrip("/")
+S3_URL_EXPIRES = int(os.getenv("IMAGE_S3_URL_EXPIRES", str(7 * 24 * 3600)))
+S3_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# ชื่อไฟล์จาก result_cache.cache_filename: <prefix>_<hash>.<ext>
+HASHED_FILENAME_PATTERN = re.compile(r"^[a-z]+_([0-9a-f]{8,})\.[a-z0-9]+$")
+
+
+def shard_key(filename: str) -> str:
+    """path ย่อยของไฟล์ เช่น converted_ab12....webp -> ab/12/converted_ab12....webp"""
+    match = HASHED_FILENAME_PATTERN.match(filename)
+    digest = match.group(1) if match else hashlib.sha256(filename.encode()).hexdigest()
+    shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return "/".join(shards + [filename])
+
+
+def content_type(filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower()
+    return Image.MIME.get(Image.registered_extensions().get(extension), "application/octet-stream")
+
+
+class LocalStorage:
+    """
+    เก็บไฟล์ผลลัพธ์ใน static/cache แบบแบ่งโฟลเดอร์ตาม hash (ส่งต่อผ่าน /static mount)
+    - เขียนลงไฟล์ชั่วคราวในโฟลเดอร์เดียวกันแล้ว os.replace (ผู้อ่านไม่เห็นไฟล์ที่เขียนไม่เสร็จ)
+    """
+
+    def __init__(self, root: str = CACHE_DIR, url_prefix: str = CACHE_URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    def local_path(self, filename: str) -> Optional[str]:
+        return os.path.join(self.root, *shard_key(filename).split("/"))
+
+    def url(self, filename: str) -> str:
+        return f"{self.url_prefix}/{shard_key(filename)}"
+
+    @contextmanager
+    def open_write(self, filename: str):
+        path = self.local_path(filename)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def write(self, filename: str, data: bytes):
+        with self.open_write(filename) as f:
+            f.write(data)
+
+    def open(self, filename: str):
+        return open(self.local_path(filename), "rb")
+
+    def read(self, filename: str) -> bytes:
+        with self.open(filename) as f:
+            return f.read()
+
+    def exists(self, filename: str) -> bool:
+        return os.path.exists(self.local_path(filename))
+
+    def size(self, filename: str) -> int:
+        return os.path.getsize(self.local_path(filename))
+
+    def touch(self, filename: str, when: float) -> bool:
+        """
+        ตั้ง mtime เป็นเวลาที่ใช้ล่าสุด (ทุก process ที่ใช้ static/cache ร่วมกันเห็นการใช้งานของกันและกัน)
+        คืน False ถ้าไม่มีไฟล์
+        """
+        try:
+            os.utime(self.local_path(filename), (when, when))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def modified(self, filename: str) -> Optional[float]:
+        try:
+            return os.stat(self.local_path(filename)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def delete(self, filename: str) -> bool:
+        try:
+            os.remove(self.local_path(filename))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def scan(self) -> Iterator[Tuple[str, float]]:
+        """
+        ไฟล์ทั้งหมดใน storage คืนค่า (filename, mtime)
+        ข้ามไฟล์ชั่วคราวที่กำลังเขียน และไฟล์ที่ไม่อยู่ในโฟลเดอร์ตาม hash ของชื่อ (ไม่ใช่ไฟล์ของ cache)
+        """
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.startswith(".tmp_") or path != self.local_path(name):
+                    continue
+                try:
+                    yield name, os.stat(path).st_mtime
+                except FileNotFoundError:
+                    pass
+
+    def response(self, filename: str, media_type: str, headers: dict) -> Response:
+        return FileResponse(self.local_path(filename), media_type=media_type, headers=headers)
+
+    def prepare(self):
+        """
+        สร้างโฟลเดอร์ cache ถ้ายังไม่มี ไม่ล้างไฟล์เดิม: uvicorn --workers N ใช้ static/cache ร่วมกัน
+        ไฟล์จากรอบก่อน / ของ process อื่นที่ไม่ถูกใช้เกิน TTL จะถูก CacheJanitor ลบเป็นไฟล์กำพร้า
+        """
+        os.makedirs(self.root, exist_ok=True)
+
+
+class S3Storage:
+    """
+    เก็บไฟล์ผลลัพธ์ใน bucket แบบ S3 (AWS / MinIO) ใช้ key แบบแบ่งโฟลเดอร์เหมือน LocalStorage
+    - put_object เป็น atomic อยู่แล้ว (ผู้อ่านเห็นทั้งไฟล์หรือไม่เห็นเลย)
+    - URL เป็น IMAGE_S3_PUBLIC_URL/<key> หรือ presigned URL
+    """
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX):
+        if boto3 is None:
+            raise RuntimeError("IMAGE_STORAGE=s3 ต้องติดตั้ง boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("IMAGE_STORAGE=s3 ต้องตั้งค่า IMAGE_S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+
+    def object_key(self, filename: str) -> str:
+        return f"{self.prefix}/{shard_key(filename)}" if self.prefix else shard_key(filename)
+
+    def local_path(self, filename: str) -> Optional[str]:
+        return None
+
+    def url(self, filename: str) -> str:
+        key = self.object_key(filename)
+        if S3_PUBLIC_URL:
+            return f"{S3_PUBLIC_URL}/{key}"
+        return self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=S3_URL_EXPIRES)
+
+    @contextmanager
+    def open_write(self, filename: str):
+        # encode ลงไฟล์ใน RAM (Pillow เขียนลง fd ตรง ๆ) แล้วส่งไฟล์นั้นเป็น body ไม่ต้องคัดลอกเป็น bytes
+        with memory_file() as f:
+            yield f
+            f.seek(0)
+            self.write(filename, f)
+
+    def write(self, filename: str, data):
+        """data เป็น bytes / mmap หรือ file object ที่อ่านได้"""
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.object_key(filename),
+            Body=data,
+            ContentType=content_type(filename),
+            CacheControl=S3_CACHE_CONTROL,
+        )
+
+    def open(self, filename: str):
+        return BytesIO(self.read(filename))
+
+    def read(self, filename: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(filename))["Body"].read()
+
+    def _head(self, filename: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(filename))
+        except self.client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, filename: str) -> bool:
+        return self._head(filename) is not None
+
+    def size(self, filename: str) -> int:
+        head = self._head(filename)
+        if head is None:
+            raise FileNotFoundError(filename)
+        return head["ContentLength"]
+
+    def touch(self, filename: str, when: float) -> bool:
+        # LastModified แก้ไม่ได้ถ้าไม่เขียน object ใหม่ S3 จึงนับอายุไฟล์กำพร้าจากเวลาที่เขียน
+        return self.exists(filename)
+
+    def modified(self, filename: str) -> Optional[float]:
+        head = self._head(filename)
+        return head["LastModified"].timestamp() if head else None
+
+    def delete(self, filename: str) -> bool:
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(filename))
+        return True
+
+    def scan(self) -> Iterator[Tuple[str, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/" if self.prefix else ""):
+            for item in page.get("Contents", []):
+                yield item["Key"].rsplit("/", 1)[-1], item["LastModified"].timestamp()
+
+    def response(self, filename: str, media_type: str, headers: dict) -> Response:
+        # ไม่อ่าน object ผ่าน API process: ให้ client ดึงจาก URL ของ storage โดยตรง (เหมือน /jobs/{id}/result)
+        return RedirectResponse(self.url(filename), status_code=303, headers=headers)
+
+    def prepare(self):
+        # ไม่ล้าง bucket ตอนเริ่ม ไฟล์จากรอบก่อนที่ไม่อยู่ใน index จะถูก CacheJanitor ลบเป็นไฟล์กำพร้า
+        pass
+
+
+_storage = None
+
+
+def get_storage():
+    """storage ตัวเดียวต่อ process (worker process ของ executor สร้างของตัวเองเมื่อเรียกครั้งแรก)"""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3Storage()
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalStorage()
+        else:
+            raise RuntimeError(f"IMAGE_STORAGE ต้องเป็น local หรือ s3 (ได้ {STORAGE_BACKEND})")
+    return _storage
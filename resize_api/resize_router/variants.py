@@ -0,0 +1,170 @@
+import asyncio
+import os
+from typing import List, Tuple
+
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from .executor import MAX_WORKERS, run_image_task
+from .pixel_pool import run_pixel_stage, resize_pixels
+from .decode import apply_jpeg_draft
+from .buffers import ImageData, open_image
+from .ingest import probe_dimensions
+from .result_cache import get_result_cache, content_digest, make_cache_key, cache_url
+from .encoders import resolve_preset
+from .formats import OUTPUT_FORMATS
+from .engine import RESAMPLING_METHODS, validate_image_file, prepare_output, save_output
+
+router = APIRouter()
+
+# Config
+MAX_VARIANTS = 8
+# ย่อจากชั้นที่ใหญ่กว่าใน pyramid ได้เมื่อชั้นนั้นกว้างอย่างน้อยกี่เท่าของขนาดเป้าหมาย
+# (ต่ำกว่านี้ resample ซ้ำสองรอบจะเบลอเห็นได้ จึงย่อจากภาพต้นฉบับแทน)
+PYRAMID_MIN_RATIO = float(os.getenv("IMAGE_PYRAMID_MIN_RATIO", "2.0"))
+
+
+def parse_list(raw: str, name: str) -> List[str]:
+    items = [item.strip().lower() for item in raw.split(",") if item.strip()]
+    if not items:
+        raise HTTPException(400, f"{name} ต้องมีอย่างน้อย 1 ค่า (คั่นด้วย ,)")
+    return list(dict.fromkeys(items))  # ตัดค่าซ้ำ คงลำดับเดิม
+
+
+def variant_sizes(widths: List[int], source_size: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """ขนาดของแต่ละ variant (คงสัดส่วนเดิม ไม่ขยายเกินต้นฉบับ) เรียงจากใหญ่ไปเล็ก"""
+    source_width, source_height = source_size
+    sizes = {}
+    for width in widths:
+        width = min(width, source_width)
+        sizes[width] = (width, max(1, round(source_height * width / source_width)))
+    return [sizes[width] for width in sorted(sizes, reverse=True)]
+
+
+def build_pyramid(contents: ImageData, sizes: List[Tuple[int, int]], resample: int) -> List[Image.Image]:
+    """
+    decode ครั้งเดียวแล้วสร้างทุกขนาดจากใหญ่ไปเล็ก
+    แต่ละขนาดย่อจากชั้นที่เล็กที่สุดที่ยังใหญ่กว่าอย่างน้อย PYRAMID_MIN_RATIO เท่า (ไม่มีก็ย่อจากต้นฉบับ)
+    """
+    try:
+        image = open_image(contents)
+        # JPEG: decode ที่ scale ใกล้ขนาดใหญ่สุดที่ต้องการได้เลย
+        apply_jpeg_draft(image, sizes[0])
+        image.load()
+    except Exception as e:
+        raise HTTPException(400, f"ไม่สามารถเปิดไฟล์ภาพได้: {str(e)}")
+
+    if image.mode == 'P':
+        image = image.convert('RGBA')  # ป้องกัน palette-based
+
+    levels = []
+    for size in sizes:
+        base = image
+        for level in reversed(levels):
+            if level.width >= size[0] * PYRAMID_MIN_RATIO:
+                base = level
+                break
+        levels.append(run_pixel_stage(resize_pixels, base, size, resample))
+    return levels
+
+
+def encode_variant(image: Image.Image, extension: str, quality: int, preset: str, cache_key: str) -> str:
+    """encode variant หนึ่งขนาด / หนึ่งรูปแบบลง cache คืนชื่อไฟล์"""
+    output, save_params = prepare_output(image, extension, quality, preset)
+    filename, _ = save_output(output, "variant", cache_key, extension, False, **save_params)
+    return filename
+
+
+@router.post("/variants")
+async def create_variants(
+    file: UploadFile = File(...),
+    widths: str = Form("1920,1280,640,320"),  # ความกว้างที่ต้องการ คั่นด้วย , (ความสูงคำนวณตามสัดส่วน)
+    formats: str = Form("webp,jpg"),  # รูปแบบไฟล์ คั่นด้วย ,
+    method: str = Form("lanczos"),
+    quality: int = Form(85, ge=1, le=100),
+    preset: str = Form("balanced")  # fast / balanced / max-compression / auto (เลือกแยกตามขนาดของแต่ละ variant)
+):
+    """
+    สร้างภาพหลายขนาด (responsive variants) จากการอัปโหลดและ decode ครั้งเดียว
+    - ย่อเป็น pyramid: ขนาดเล็กย่อต่อจากขนาดที่ใหญ่กว่าแทนการย่อจากต้นฉบับทุกครั้ง
+    - encode ทุกขนาด / ทุกรูปแบบพร้อมกันบน worker pool
+    - คืน URL ของทุก variant และ srcset แยกตามรูปแบบไฟล์
+    - ไม่ขยายภาพเกินขนาดต้นฉบับ (ความกว้างที่เกินจะถูกรวมเป็นขนาดต้นฉบับ)
+    """
+    try:
+        try:
+            requested_widths = [int(width) for width in parse_list(widths, "widths")]
+        except ValueError:
+            raise HTTPException(400, "widths ต้องเป็นจำนวนเต็มคั่นด้วย , เช่น 1920,1280,640")
+        if any(width <= 0 for width in requested_widths):
+            raise HTTPException(400, "widths ต้องมากกว่า 0")
+        if len(requested_widths) > MAX_VARIANTS:
+            raise HTTPException(400, f"สร้างได้สูงสุด {MAX_VARIANTS} ขนาดต่อคำขอ")
+        extensions = parse_list(formats, "formats")
+        if any(extension not in OUTPUT_FORMATS for extension in extensions):
+            raise HTTPException(400, f"formats ต้องเป็นหนึ่งใน {list(OUTPUT_FORMATS)}")
+        if method not in RESAMPLING_METHODS:
+            raise HTTPException(400, f"method ต้องเป็นหนึ่งใน {list(RESAMPLING_METHODS)}")
+
+        contents, _ = await validate_image_file(file)
+        source_size = probe_dimensions(contents)
+        if source_size is None:
+            raise HTTPException(400, "ไม่สามารถอ่านขนาดภาพได้")
+        sizes = variant_sizes(requested_widths, source_size)
+
+        # key ต่อ variant: ขนาด / รูปแบบที่เคยทำแล้วไม่ต้อง encode ใหม่ (ใช้ preset ที่ resolve แล้ว ไม่ใช่ auto)
+        # hash ไฟล์ต้นฉบับครั้งเดียว แล้วสร้าง key ทุก variant จาก digest นั้น
+        cache = get_result_cache()
+        digest = await content_digest(contents)
+        encoders = {
+            (size, extension): resolve_preset(preset, size[0] * size[1], OUTPUT_FORMATS[extension])
+            for size in sizes for extension in extensions
+        }
+        keys = {
+            variant: make_cache_key(digest, "variant", method=method, size=variant[0], extension=variant[1], quality=quality, preset=encoder)
+            for variant, encoder in encoders.items()
+        }
+        # ค้นหา cache ทุก variant พร้อมกัน (S3 เป็น HEAD หนึ่งครั้งต่อ variant)
+        results = dict(zip(keys, await asyncio.gather(*(cache.get(key) for key in keys.values()))))
+        missing = [variant for variant, result in results.items() if result is None]
+
+        if missing:
+            levels = await run_image_task(build_pyramid, contents, sizes, RESAMPLING_METHODS[method])
+            images = dict(zip(sizes, levels))
+            # encode พร้อมกันไม่เกินจำนวน worker (ไม่ให้คำขอเดียวชน MAX_PENDING ของ executor)
+            slots = asyncio.Semaphore(MAX_WORKERS)
+
+            async def encode(size, extension):
+                async with slots:
+                    return await run_image_task(encode_variant, images[size], extension, quality, encoders[(size, extension)], keys[(size, extension)])
+
+            encoded = await asyncio.gather(*(encode(size, extension) for size, extension in missing))
+            for (size, extension), filename in zip(missing, encoded):
+                results[(size, extension)] = {
+                    "filename": filename,
+                    "url": cache_url(filename),
+                    "format": extension,
+                    "width": size[0],
+                    "height": size[1],
+                    "preset": encoders[(size, extension)],
+                }
+            await asyncio.gather(*(cache.put(keys[variant], results[variant]["filename"], results[variant]) for variant in missing))
+
+        variants = [results[(size, extension)] for size in sizes for extension in extensions]
+        srcset = {
+            extension: ", ".join(f"{result['url']} {result['width']}w" for result in variants if result["format"] == extension)
+            for extension in extensions
+        }
+        return JSONResponse({
+            "source_width": source_size[0],
+            "source_height": source_size[1],
+            "method": method,
+            "variants": variants,
+            "srcset": srcset,
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"การสร้างภาพหลายขนาดล้มเหลว: {str(e)}")